@@ -14,6 +14,9 @@ from datetime import datetime
 import h5py
 import re
 
+from granule_checks import check_granule
+from granule_catalog import open_catalog, register_granules
+
 # Paths to local directories to save the data in
 out_top_dir = '/data/atsr/OptForEU'
 soc_dir = f'{out_top_dir}/SMAP_Soil_Carbon'
@@ -39,3 +42,8 @@ results = earthaccess.search_data(
 )
 
 files = earthaccess.download(results, soc_dir_input)
+
+# Record the downloaded files in the granule catalog used by the process script
+catalog = open_catalog(f'{out_top_dir}/granule_catalog.sqlite')
+register_granules(catalog, files, 'SMAP_SOC', check=check_granule)
+catalog.close()
@@ -24,7 +24,10 @@ from rasterio.mask import mask
 from shapely.geometry import box
 from rasterio.io import MemoryFile
 
-def download_tcd_wekeo(tcd_dir, year):
+from granule_checks import check_archive
+from granule_catalog import open_catalog, register_archive_members
+
+def download_tcd_wekeo(tcd_dir, year, catalog):
 
     query_tcd = {
         'dataset_id': 'EO:CLMS:DAT:HRL',
@@ -49,10 +52,11 @@ def download_tcd_wekeo(tcd_dir, year):
 
     zip_filename = matches_tcd.results[-1]['id']
 
-    with zipfile.ZipFile(f"{path_yr_dir}/{zip_filename}.zip", 'r') as zip_ref:
-        zip_ref.extractall(path_yr_dir)
+    # Record the mosaic inside the archive in the granule catalog used by the process script. It is
+    # read in place through GDAL /vsizip/, so the multi-GB archive is not extracted
+    register_archive_members(catalog, f"{path_yr_dir}/{zip_filename}.zip", 'TCD', suffixes=('.tif',), check=check_archive)
 
-    print(f'Unzipped file for {year}!')
+    print(f'Catalogued file for {year}!')
 
 # Local paths to directories where data is downloaded to
 out_top_dir = '/data/atsr/OptForEU'
@@ -79,6 +83,11 @@ config = Configuration()
 
 c = Client(config=config)
 
-download_tcd_wekeo(tcd_dir, "2012")
-download_tcd_wekeo(tcd_dir, "2015")
-download_tcd_wekeo(tcd_dir, "2018")
+# Catalog of downloaded files
+catalog = open_catalog(f'{out_top_dir}/granule_catalog.sqlite')
+
+download_tcd_wekeo(tcd_dir, "2012", catalog)
+download_tcd_wekeo(tcd_dir, "2015", catalog)
+download_tcd_wekeo(tcd_dir, "2018", catalog)
+
+catalog.close()
@@ -14,11 +14,17 @@ import re
 from datetime import datetime
 from geopy.distance import distance
 
+from granule_checks import check_archive
+from granule_catalog import open_catalog, register_archive_members
+
 # Local directory paths to save data in
 out_top_dir = '/data/atsr/OptForEU'
 ba_dir = f'{out_top_dir}/C3S_Burned_Area'
 os.makedirs(ba_dir, exist_ok=True)
 
+# Catalog of downloaded files
+catalog = open_catalog(f'{out_top_dir}/granule_catalog.sqlite')
+
 # years to loop over when downloading year by year
 years = ['2017', '2018', '2019', '2020', '2021', '2022']
 # Download the data
@@ -51,3 +57,9 @@ for year_d in years:
     ba_filename = os.path.join(ba_dir, f'c3s_pixel_burned_area_v1_1_{year_d}_monthly.zip')
 
     c.retrieve(dataset, request, ba_filename)
+
+    # Record the monthly NetCDF files inside the yearly archive in the granule catalog. The process
+    # script reads them straight from the zip file, so there is no need to extract them
+    register_archive_members(catalog, ba_filename, 'FIRES', suffixes=('.nc',), check=check_archive)
+
+catalog.close()
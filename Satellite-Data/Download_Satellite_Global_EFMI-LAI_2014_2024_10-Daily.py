@@ -17,6 +17,9 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 
+from granule_checks import check_granule, expected_dekads
+from granule_catalog import open_catalog, scan_directory, query_invalid, remove_granules, find_missing_dates
+
 # Default location expected by hda package
 hdarc = Path(Path.home() / '.hdarc')
 
@@ -89,64 +92,34 @@ for res in np.arange(0, len(matches_gdmp.results)):
         print(str(res+1) + '/' + str(len(matches_gdmp.results)))
 
 
-# Check missing dates
-#ex_cp_filename = glob.glob(f'{d_dir}*RT5*.nc')
-#ex_cp_filename = glob.glob(f'{d_dir}*LAI300_*.nc') # equivalent to RT5
-ex_cp_filename = glob.glob(f'{d_dir}*RT0*.nc')
+# Record the downloaded files (RT5 and RT0) in the granule catalog used by the process script.
+# Only new or changed files are checked, reading their signature, size and header.
+catalog = open_catalog()
+scan_directory(catalog, f'{d_dir}c_gls_LAI300*.nc', var_product, check=check_granule)
 
 # Some files don't exist/are corrupt, so save them to a list to download again
 # and remove corrupt files
-corrupt_files = []
-for fl in ex_cp_filename:
-    try:
-        ds_example = xr.open_dataset(f'{fl}')
-    except OSError:
-        corrupt_files.append(fl)
-        pass
-
-s_corrupt_files = sorted(corrupt_files)
+s_corrupt_files = query_invalid(catalog, var_product)
 
 if len(s_corrupt_files) != 0:
     print('Download these again:')
-    for corrupt in s_corrupt_files:
-        print(corrupt)
+    for corrupt, reason in s_corrupt_files:
+        print(corrupt, reason)
         try:
             os.remove(corrupt)
         except OSError:
             pass
+    remove_granules(catalog, [corrupt for corrupt, reason in s_corrupt_files])
+
+# Check missing dates, comparing the 10-daily dates expected to have been downloaded
+# for the time range to the dates of the valid files in the catalog. Each product group is checked on
+# its own, so an RT5 file does not hide a missing RT0 file of the same dekad
+for lai_group in ['RT0', 'RT5']:
+    missing_dates = np.array(find_missing_dates(catalog, var_product, expected_dekads('2014-01-10', '2024-01-10'), group=lai_group), dtype='datetime64')
+
+    if len(missing_dates) != 0:
+        print(f'Missing {lai_group} dates:')
+        for missing in missing_dates:
+            print(missing)
 
-# Fill time in with a random date if there is no time variable
-def add_time_dim(xda):
-    xda = xda.expand_dims(time = [datetime.now()])
-    return xda
-
-try:
-    ds_example = xr.open_mfdataset(ex_cp_filename, engine='netcdf4', preprocess=add_time_dim)
-except:
-    ds_example = xr.open_mfdataset(ex_cp_filename, engine='netcdf4')
-
-# Create a list of datetimes expected to have been downloaded for the time range
-start_dates = pd.date_range(start='2014-01', end='2024-01', freq='MS') + timedelta(days=9)
-mid_dates = pd.date_range(start='2014-01', end='2023-12', freq='MS') + timedelta(days=19)
-end_dates = pd.date_range(start='2014-01', end='2024-01', freq='ME')
-
-start_and_mid_dates = start_dates.append(mid_dates)
-all_dates = start_and_mid_dates.append(end_dates)
-all_dates_sorted = sorted(all_dates)
-all_dates_sorted_dt = np.array(all_dates_sorted, dtype='datetime64')
-
-# Compare to files downloaded
-# Assign the actual date from the data file
-dates = []
-for dd in np.arange(0,len(ex_cp_filename)):
-    # LAI RT0
-    dates.append(ex_cp_filename[dd][56:64])
-
-dates_df = pd.to_datetime(dates, format='%Y%m%d')
-ds_example['time'] = dates_df
-
-downloaded_dates = ds_example.time.values
-mask_missing_dates = np.isin(all_dates_sorted_dt, downloaded_dates)
-
-idx_missing_dates = np.where(mask_missing_dates==False)[0]
-missing_dates = all_dates_sorted_dt[idx_missing_dates]
+catalog.close()
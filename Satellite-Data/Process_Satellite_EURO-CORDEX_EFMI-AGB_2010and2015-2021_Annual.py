@@ -4,7 +4,7 @@ __other_citations__ = ["Millington, J., & This EDS book notebook contributors. E
 __version__ = "1"
 __description__ = "Produces EFMI #4.1 Carbon Stored in living biomass. Resamples the spatial resolution and subsets to the EURO CORDEX region domain, and is multiplied by 0,5 to get the Carbon stock"
 __inputs__ = "ESA-CCI biomass map v5, at 100m resolution, for 2010 and 2015-2021, with units Mg/ha. Data was downloaded manually from https://data.ceda.ac.uk/neodc/esacci/biomass/data/agb/maps/v5.0/netcdf"
-__outputs__ = "File named rs_veg_europe_agb_none_ann_2010_2021_v1_esacci.nc, at 1km resolution, for 2010 and 2015-2021, with units tonnes/ha"
+__outputs__ = "File named rs_veg_europe_agb_none_ann_2010_2021_v1_esacci.nc, at 1km resolution, for 2010 and 2015-2021, with units tonnes/ha. With write_pyramid_levels, file named rs_veg_europe_agb_multiscale_ann_2010_2021_v1_esacci.nc with the 1km, 5km, 10km and 0.1 degree levels as groups"
 
 import glob
 import xarray as xr
@@ -13,11 +13,18 @@ import os
 import re
 from datetime import datetime
 
+from aligned_chunks import bbox_slice, disk_chunks, axis_chunks, coarse_coord
+from subset_cache import cached_subsets
+from block_reduce import block_reduce
+from pyramid import write_pyramid
+
 # Local directory path where downloaded data is stored
 out_top_dir = '/data/atsr/OptForEU'
 agb_dir = f'{out_top_dir}/ESACCI_AGB'
 # Local directory path where output will be saved
 out_agb_dir = f'{agb_dir}/Europe/input/remote_sensing/vegetation/'
+# Local directory path where the EURO-CORDEX subsets of the global files are cached
+subset_cache_dir = f'{out_top_dir}/subset_cache'
 if not os.path.exists(out_agb_dir):
     os.makedirs(out_agb_dir)
 
@@ -27,33 +34,43 @@ eur_max_lon = 65.25
 eur_min_lat = 21.75
 eur_max_lat = 72.75
 # Search for files within download local directory
-agb_filename_yr = glob.glob(f'{agb_dir}/*.nc')
-# Open files as an xarray
-agb_data = xr.open_mfdataset(agb_filename_yr, engine="h5netcdf")
-# Get rid of variables we don't need
-agb_data = agb_data.drop_vars(['time_bnds',
-                                'lat_bnds',
-                                'lon_bnds',
-                                'crs',
-                                'agb_sd'
-                                ])
+agb_filename_yr = sorted(glob.glob(f'{agb_dir}/*.nc'))
+# The EURO-CORDEX subset of each global file is read once and kept in the cache, later runs read it from there
+agb_filename_yr = cached_subsets(agb_filename_yr, (eur_min_lon, eur_max_lon, eur_min_lat, eur_max_lat), subset_cache_dir, variables=['agb'])
+# Resample from 100m resolution to 1km
+factor = 10
+# Select data within the EURO-CORDEX domain: a contiguous index range of the global grid, trimmed to
+# whole 10x10 blocks
+with xr.open_dataset(agb_filename_yr[0], engine="h5netcdf") as agb_grid:
+    agb_lat, agb_lon = agb_grid.lat.values, agb_grid.lon.values
+agb_lat_window = bbox_slice(agb_lat, eur_min_lat, eur_max_lat, factor)
+agb_lon_window = bbox_slice(agb_lon, eur_min_lon, eur_max_lon, factor)
+# Dask chunks are whole on-disk (HDF5) chunks, and within the domain they start and end on 10x10 block
+# boundaries, so each chunk is read from whole disk chunks and is coarsened on its own
+agb_disk_chunks = disk_chunks(agb_filename_yr[0], 'agb')
+agb_chunks = {
+    'time': 1,
+    'lat': axis_chunks(agb_lat.size, agb_lat_window, agb_disk_chunks['lat'], factor),
+    'lon': axis_chunks(agb_lon.size, agb_lon_window, agb_disk_chunks['lon'], factor),
+}
+# Open files as an xarray, only the variable we need
+agb_data = xr.open_mfdataset(agb_filename_yr, engine="h5netcdf", chunks=agb_chunks)[['agb']]
 # Convert dates to datetime
 dates = agb_data.time.values
 year = dates.astype('datetime64[Y]').astype(int) + 1970
-# Select data within the EURO-CORDEX domain
-agb_lat, agb_lon = agb_data.lat.values, agb_data.lon.values
-agb_lon_ind_range = np.where((agb_lon >= eur_min_lon) & (agb_lon <= eur_max_lon))[0]
-agb_lat_ind_range = np.where((agb_lat >= eur_min_lat) & (agb_lat <= eur_max_lat))[0]
-# Crop the data to the EURO-CORDEX domain
-agb_data_eur = agb_data.isel(
-                            lat = agb_lat_ind_range,
-                            lon = agb_lon_ind_range
-                            )
+# Crop the data to the EURO-CORDEX domain, the slice falls on chunk edges
+agb_data_eur = agb_data['agb'].isel(lat=agb_lat_window, lon=agb_lon_window)
 
-# Resample from 100m resolution to 1km
-agb_data_eur_1km = agb_data_eur.coarsen(lon=10, lat=10, boundary="trim").mean()
-agb_data_eur_1km = agb_data_eur_1km.assign_coords(time=year)
-agb_data.close()
+# Mean of each 10x10 block (ignoring missing values), chunk by chunk
+agb_eur_1km = block_reduce(agb_data_eur.data, factor, ('mean',))['mean']
+agb_data_eur_1km = xr.Dataset(
+    {'agb': (('time', 'lat', 'lon'), agb_eur_1km)},
+    coords={
+        'time': year,
+        'lat': coarse_coord(agb_lat, agb_lat_window, factor),
+        'lon': coarse_coord(agb_lon, agb_lon_window, factor),
+    },
+)
 
 # Mutiply AGB by 0.5 to get Carbon stock
 agb_data_eur_1km['carbon_stock'] = agb_data_eur_1km['agb'] * 0.5
@@ -76,3 +93,15 @@ agb_data_eur_1km.attrs['Author_names'] = 'Dr. Rocio Barrio Guillo, Dr. Jasdeep S
 
 # Save processed data to a netcdf
 agb_data_eur_1km.to_netcdf(f'{out_agb_dir}/{agb_eur_flname_output}')
+
+# Coarser 5km, 10km and 0.1 degree levels, reduced in cascade from the 1km output in one pass and saved
+# with it as the groups of one multiscale file
+write_pyramid_levels = True
+if write_pyramid_levels:
+    agb_pyr_flname_output = 'rs_veg_europe_agb_multiscale_ann_2010_2021_v1_esacci.nc'
+    with xr.open_dataset(f'{out_agb_dir}/{agb_eur_flname_output}', chunks={}) as agb_1km:
+        write_pyramid(
+            f'{out_agb_dir}/{agb_pyr_flname_output}',
+            agb_1km['carbon_stock'],
+            attrs=dict(agb_1km.attrs, Filename=agb_pyr_flname_output),
+        )
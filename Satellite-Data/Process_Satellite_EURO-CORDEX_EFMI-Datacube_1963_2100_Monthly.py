@@ -0,0 +1,141 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Assembles the harmonised EURO-CORDEX analysis datacube. The satellite EFMI layers (LAI, LST, AGB, FIRES, soil carbon, TCD change and disturbance fractions) and the EURO-CORDEX climate projections are regridded to the 0.1 degree ERA5-Land grid of the projections, with area-conservative weights cached per source grid, and written with normalised time coordinates to one chunked netCDF file"
+__inputs__ = "Outputs of the Process_Satellite_EURO-CORDEX_EFMI-*.py scripts and of the Projection-Data/Process_Projection_Europe_*_2006_2100.py scripts (HIRHAM5 and RACMO22E, RCP26, RCP45 and RCP85)"
+__outputs__ = "File named rs_veg_europe_datacube_none_mon_1963_2100_v1_optforeu.nc, at 0.1 degree resolution over the EURO-CORDEX domain, with one variable per layer: monthly layers on the 'time' axis (month start dates), annual layers on the 'year' axis (integer years) and the projections with the additional 'model' and 'scenario' dimensions"
+
+import os
+
+from datacube import assemble_datacube
+from ease_grid import regular_grid
+
+out_top_dir = '/data/atsr/OptForEU'
+out_cube_dir = f'{out_top_dir}/Datacube/Europe/input/'
+os.makedirs(out_cube_dir, exist_ok=True)
+# Path to keep the regridding weights, one pair per source grid
+weights_dir = f'{out_top_dir}/Datacube/regrid_weights'
+
+# Directories of the inputs
+veg_dir = 'Europe/input/remote_sensing/vegetation'
+efda_dir = '/gws/pw/j07/leicester/OPTFOREU/EFMI_EFDA'
+lst_dir = '/gws/pw/j07/leicester/OPTFOREU/EFMI_LST'
+projection_dir = '/path/to/EURO-CORDEX'
+
+# EURO-CORDEX domain, on the 0.1 degree ERA5-Land grid of the projections
+eur_min_lon = -44.75
+eur_max_lon = 65.25
+eur_min_lat = 21.75
+eur_max_lat = 72.75
+target_lon, target_lat = regular_grid(eur_min_lon, eur_max_lon, eur_min_lat, eur_max_lat, 0.1)
+
+# Satellite layers, with the time encoding of each file normalised by datacube.py (string year_month,
+# integer years or datetimes). The TCD change GeoTIFFs keep the EPSG:3035 grid of the CLMS tiles and are
+# warped to EPSG:4326 before they are regridded
+tcd_files = {
+    f'{out_top_dir}/CLMS_TCD/{veg_dir}/rs_veg_europe_changeTCD_none_ann_{year}_v1_clms.tif': year
+    for year in (2015, 2018)
+}
+layers = {
+    'LAI': {
+        'path': f'{out_top_dir}/CLMS_LAI/{veg_dir}/new_rs_veg_europe_lai_none_mon_2014_2024_v1_clms.nc',
+        'variable': 'LAI', 'frequency': 'monthly',
+        'attrs': {'long_name': 'Leaf area index', 'units': 'none'},
+    },
+    'lst': {
+        'path': f'{lst_dir}/rs_veg_europe_lst_none_mon_2000_2018_v1_esacci.nc',
+        'variable': 'lst', 'frequency': 'monthly', 'time_dim': 'year_month',
+        'attrs': {'long_name': 'Land surface temperature', 'units': 'K'},
+    },
+    'agb': {
+        'path': f'{out_top_dir}/ESACCI_AGB/{veg_dir}/rs_veg_europe_agb_none_ann_2010_2021_v1_esacci.nc',
+        'variable': 'agb', 'frequency': 'annual',
+        'attrs': {'long_name': 'Above ground biomass', 'units': 'tons_per_ha'},
+    },
+    'fires': {
+        'path': f'{out_top_dir}/C3S_Burned_Area/{veg_dir}/rs_veg_europe_fires_none_mon_2010_2021_v1_esacci.nc',
+        'variable': 'fires', 'frequency': 'monthly',
+        'attrs': {'long_name': 'Fraction of the cell with burned 1km cells, all land cover classes', 'units': '1'},
+    },
+    'forest_fires': {
+        'path': f'{out_top_dir}/C3S_Burned_Area/{veg_dir}/rs_veg_europe_fires_none_mon_2010_2021_v1_esacci.nc',
+        'variable': 'forest_fires', 'frequency': 'monthly',
+        'attrs': {'long_name': 'Fraction of the cell with burned 1km cells, forest land cover classes', 'units': '1'},
+    },
+    'SOC': {
+        'path': f'{out_top_dir}/SMAP_Soil_Carbon/{veg_dir}/rs_veg_europe_soilCarbon_none_mon_2015_2024_v1_smap.nc',
+        'variable': 'SOC', 'frequency': 'monthly',
+        'attrs': {'long_name': 'Carbon stored in soils', 'units': 'tons C m-2'},
+    },
+    'changeTCD': {
+        'path': list(tcd_files), 'time': tcd_files, 'frequency': 'annual',
+        'attrs': {'long_name': 'Change in tree cover density with respect to 2012', 'units': '%'},
+    },
+    'disturbed_fraction': {
+        'path': f'{efda_dir}/rs_veg_europe_disturbancefraction0p1deg_none_ann_1985_2023_v1_efda.nc',
+        'variable': 'disturbed_fraction', 'frequency': 'annual', 'time_dim': 'year',
+        'attrs': {'long_name': 'Wind & Bark Beetle disturbed area fraction', 'units': '1'},
+    },
+    'weather_affected_fraction': {
+        'path': f'{out_top_dir}/FORWIND/{veg_dir}/rs_veg_europe_disturbanceWeatherfraction0p1deg_none_ann_2000_2018_v1_forwind.nc',
+        'variable': 'affected_fraction', 'frequency': 'annual', 'time_dim': 'year',
+        'attrs': {'long_name': 'Severe weather affected area fraction', 'units': '1'},
+    },
+    'insects_affected_fraction': {
+        'path': f'{out_top_dir}/DEFID2/{veg_dir}/rs_veg_europe_disturbanceInsectsDiseasefraction0p1deg_none_ann_1963_2021_v1_defid2.nc',
+        'variable': 'affected_fraction', 'frequency': 'annual', 'time_dim': 'year',
+        'attrs': {'long_name': 'Insects & Disease affected area fraction', 'units': '1'},
+    },
+}
+
+# EURO-CORDEX projections, (file prefix, variable name in the file, units) of each layer, for every
+# model and scenario
+models = ['HIRHAM5', 'RACMO22E']
+scenarios = ['RCP26', 'RCP45', 'RCP85']
+projections = {
+    'downlong': ('rlds', 'W m-2'),
+    'downshort': ('rsds', 'W m-2'),
+    'evap': ('evspsbl', 'kg m-2 s-1'),
+    'maxtair': ('tasmax', 'K'),
+    'meantair': ('tas', 'K'),
+    'mintair': ('tasmin', 'K'),
+    'precip': ('pr', 'kg m-2 s-1'),
+    'runoff': ('mrro', 'kg m-2 s-1'),
+    'slp': ('psl', 'Pa'),
+    'sphum': ('huss', 'kg kg-1'),
+    'windsp': ('sfcWind', 'm s-1'),
+}
+for prefix, (variable, units) in projections.items():
+    layers[prefix] = {
+        'ensemble': {
+            (model, scenario): f'{projection_dir}/{scenario}/{model}/concat/{prefix}_europe_{model}_{scenario}_mon_2006_2100.nc'
+            for model in models for scenario in scenarios
+        },
+        'variable': variable, 'frequency': 'monthly',
+        'attrs': {'units': units},
+    }
+
+cube_flname_output = 'rs_veg_europe_datacube_none_mon_1963_2100_v1_optforeu.nc'
+
+# Metadata
+attrs = {}
+attrs['Filename'] = cube_flname_output
+attrs['Variables'] = ', '.join(layers)
+attrs['Units'] = 'See the units attribute of each variable'
+attrs['Data_source'] = 'OptFor-EU satellite EFMIs (CLMS, ESA CCI, C3S, SMAP, EFDA, FORWIND, DEFID2) and EURO-CORDEX projections (HIRHAM5, RACMO22E)'
+attrs['Time_period'] = '1963-2100'
+attrs['Time_averaging'] = 'Monthly (time) and Annual (year)'
+attrs['Spatial_extent'] = 'Europe'
+attrs['Coordinate_system'] = 'EPSG:4326'
+attrs['Author_names'] = 'Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo'
+
+# Every layer is regridded area-conservatively, NaN cells left out, and written in blocks of 12 time
+# steps. The whole cube is then one lazy open: xr.open_dataset(path, chunks={})
+assemble_datacube(
+    f'{out_cube_dir}/{cube_flname_output}',
+    layers,
+    target_lat,
+    target_lon,
+    weights_dir,
+    ensemble_coords={'model': models, 'scenario': scenarios},
+    attrs=attrs,
+)
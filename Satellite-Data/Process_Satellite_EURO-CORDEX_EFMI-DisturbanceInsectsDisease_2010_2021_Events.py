@@ -3,7 +3,7 @@ __other_citations__ = "Forzieri G et al. (2023). The Database of European Forest
 __version__ = "1"
 __description__ = "Produces EFMI #5.1 Forest area with damage caused by insects and diseases. Subsets to the EURO CORDEX region domain"
 __inputs__ = "DEFID2 database, at day/event of disturbance resolution, for 1963-08-01 to 2021-09-30, with units ha. Data was downloaded from Data was downloaded manually from https://jeodpp.jrc.ec.europa.eu/ftp/jrc-opendata/FOREST/DISTURBANCES/DEFID2/VER1-0/"
-__outputs__ = "File named rs_veg_europe_disturbanceInsectsDisease_none_event_1963_2021_v1_defid2.shp, area shapefile, daily/event for 1963-08-01 to 2021-09-30, with units ha; and a file named metadata_rs_veg_europe_disturbanceInsectsDisease_none_event_1963_2021_v1_defid2.txt with the metadata for the shapefile."
+__outputs__ = "File named rs_veg_europe_disturbanceInsectsDisease_none_event_1963_2021_v1_defid2.parquet, area GeoParquet with the metadata in the file, daily/event for 1963-08-01 to 2021-09-30, with units ha. Files named rs_veg_europe_disturbanceInsectsDiseasefraction1km_none_ann_1963_2021_v1_defid2.nc and rs_veg_europe_disturbanceInsectsDiseasefraction0p1deg_none_ann_1963_2021_v1_defid2.nc, at 1km and 0.1 degree resolution over the EURO-CORDEX domain, annual for 1963-2021, with the fraction of each cell affected by the events of the year"
 
 import xarray as xr
 import numpy as np
@@ -17,6 +17,10 @@ from IPython import embed
 import os
 from datetime import datetime
 
+from event_layers import clip_to_box, write_geoparquet
+from event_rasters import rasterise_events
+from disturbance_fraction import target_resolutions, target_grid
+
 # Local paths to directories where data has been downloaded to
 out_top_dir = '/data/atsr/OptForEU'
 ins_dir = f'{out_top_dir}/DEFID2'
@@ -38,14 +42,9 @@ ins_loc = f'{ins_dir}/defid2.gpkg'
 # First, read in DEFID2 data into geopandas
 ins_data = gpd.read_file(ins_loc)
 
-# Next, create bounding box
-gdf = box(eur_min_lon, eur_min_lat, eur_max_lon, eur_max_lat)
-
-# Convert this into a geodataframe
-gdf = gpd.GeoDataFrame([1], geometry = [gdf], crs = ins_data.crs)
-
 # Clip DEFID2 to bounding box - although the extent is smaller than the EURO-CORDEX so remains the same
-ins_gdf = ins_data.clip(gdf)
+# With the spatial index, polygons inside the box are kept as they are and only the ones crossing its boundary are intersected
+ins_gdf = clip_to_box(ins_data, eur_min_lon, eur_min_lat, eur_max_lon, eur_max_lat)
 # Convert date to datetime
 ins_gdf['survey_date'] = pd.to_datetime(ins_gdf['survey_date'])
 
@@ -62,14 +61,11 @@ if ins_final_gdf.crs != "EPSG:4326":
     ins_final_gdf = ins_final_gdf.to_crs("EPSG:4326")
 
 # Filename to save output as
-ins_eur_flname_output = 'rs_veg_europe_disturbanceInsectsDisease_none_event_1963_2021_v1_defid2.shp'
+ins_eur_flname_output = 'rs_veg_europe_disturbanceInsectsDisease_none_event_1963_2021_v1_defid2.parquet'
 # Some geometries were corrupt but if we fix them we lose data
 # if ins_final_gdf.is_valid.all() == False:
 #     ins_final_gdf["geometry"] = ins_final_gdf["geometry"].apply(lambda geom: geom.buffer(0) if not geom.is_valid else geom)
-# Save as a shapefile
-ins_final_gdf.to_file(f'{out_ins_dir}{ins_eur_flname_output}', driver='ESRI Shapefile')
-
-# Save metadata to a sidecar file
+# Metadata, stored in the GeoParquet file
 metadata = {
     "Filename": ins_eur_flname_output,
     "Variables": "area_ha",
@@ -81,7 +77,34 @@ metadata = {
     "Author names": "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
 }
 
-# Write metadata to a text file
-with open(f'{out_ins_dir}metadata_rs_veg_europe_disturbanceInsectsDisease_none_event_1963_2021_v1_defid2.txt', 'w') as f:
-    for key, value in metadata.items():
-        f.write(f"{key}: {value}\n")
+# Save as GeoParquet, sorted by year and location with per-row bbox columns, and with the metadata in the file
+write_geoparquet(ins_final_gdf, f'{out_ins_dir}{ins_eur_flname_output}', metadata, 'survey_date')
+
+# Affected area fraction of the 1km and 0.1 degree grids of the EURO-CORDEX domain for every year with events,
+# so the events can be used with the other gridded layers. Overlapping events of a year are counted once
+grids = {
+    name: target_grid(eur_min_lon, eur_max_lon, eur_min_lat, eur_max_lat, resolution)
+    for name, resolution in target_resolutions.items()
+}
+ins_frac_flname_output = {
+    '1km': 'rs_veg_europe_disturbanceInsectsDiseasefraction1km_none_ann_1963_2021_v1_defid2.nc',
+    '0.1deg': 'rs_veg_europe_disturbanceInsectsDiseasefraction0p1deg_none_ann_1963_2021_v1_defid2.nc',
+}
+
+frac_attrs = {}
+frac_attrs['Variables'] = 'Insects & Disease affected area fraction (affected_fraction)'
+frac_attrs['Units'] = 'fraction of the cell area'
+frac_attrs['Data_source'] = 'DEFID2 database'
+frac_attrs['Time_period'] = '1963-2021'
+frac_attrs['Time_averaging'] = 'Annual'
+frac_attrs['Spatial_extent'] = 'Europe'
+frac_attrs['Coordinate_system'] = 'EPSG:4326'
+frac_attrs['Author_names'] = 'Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand'
+
+rasterise_events(
+    ins_final_gdf,
+    'survey_date',
+    grids,
+    {name: f'{out_ins_dir}{filename}' for name, filename in ins_frac_flname_output.items()},
+    attrs=frac_attrs,
+)
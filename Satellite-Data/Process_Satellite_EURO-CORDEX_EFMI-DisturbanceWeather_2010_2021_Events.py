@@ -4,7 +4,7 @@ __other_citations__ = "Forzieri, Giovanni; Pecchi, Matteo; Girardello, Marco; Ma
 __version__ = "1"
 __description__ = "Produces EFMI #6.1 Forest area with damage caused by severe weather events. Subsets to the EURO CORDEX region domain"
 __inputs__ = "FORWIND database, at day/event of disturbance resolution, for 2000-07-25 to 2018-10-28, with units ha. Data was downloaded manually from https://figshare.com/articles/dataset/A_spatially-explicit_database_of_wind_disturbances_in_European_forests_over_the_period_2000-2018/9555008"
-__outputs__ = "File named rs_veg_europe_disturbanceWeather_none_event_2000_2018_v1_forwind.shp, area shapefile, daily/event for 2000-07-25 to 2018-10-28, with units ha"
+__outputs__ = "File named rs_veg_europe_disturbanceWeather_none_event_2000_2018_v1_forwind.parquet, area GeoParquet with the metadata in the file, daily/event for 2000-07-25 to 2018-10-28, with units ha. Files named rs_veg_europe_disturbanceWeatherfraction1km_none_ann_2000_2018_v1_forwind.nc and rs_veg_europe_disturbanceWeatherfraction0p1deg_none_ann_2000_2018_v1_forwind.nc, at 1km and 0.1 degree resolution over the EURO-CORDEX domain, annual for 2000-2018, with the fraction of each cell affected by the events of the year"
 
 
 import xarray as xr
@@ -18,6 +18,10 @@ from shapely.geometry import box
 import os
 from datetime import datetime
 
+from event_layers import clip_to_box, write_geoparquet
+from event_rasters import rasterise_events
+from disturbance_fraction import target_resolutions, target_grid
+
 # Paths to local directories where data has been downloaded to
 out_top_dir = '/data/atsr/OptForEU'
 wea_dir = f'{out_top_dir}/FORWIND'
@@ -39,13 +43,9 @@ wea_loc = f'{wea_dir}/FORWIND_v2.shp'
 # First, read in FORWIND data into geopandas
 wea_data = gpd.read_file(wea_loc)
 
-# Next, create bounding box
-gdf = box(eur_min_lon, eur_min_lat, eur_max_lon, eur_max_lat)
-
-# Convert this into a geodataframe
-gdf = gpd.GeoDataFrame([1], geometry=[gdf], crs=wea_data.crs)
-
-wind_gdf = gdf.overlay(wea_data, how = 'intersection')
+# Next, clip to the bounding box with the spatial index: polygons inside the box are kept as they are,
+# only the ones crossing its boundary are intersected
+wind_gdf = clip_to_box(wea_data, eur_min_lon, eur_min_lat, eur_max_lon, eur_max_lat)
 
 # First, convert the EventDate into datetime (some entries have the event date as: %Y/%m/%d, while
 # some have them as: %Y-%m-%d. Have to account for both!
@@ -65,11 +65,10 @@ wind_final_gdf = wind_gdf_eqcrs[['EventDate_dt', 'geometry', 'area_ha']]
 if wind_final_gdf.crs != "EPSG:4326":
     wind_final_gdf = wind_final_gdf.to_crs("EPSG:4326")
 
-# Save to shapefile
-wind_eur_flname_output = 'rs_veg_europe_disturbanceWeather_none_event_2000_2018_v1_forwind.shp'
-wind_final_gdf.to_file(f'{out_wea_dir}{wind_eur_flname_output}', driver='ESRI Shapefile')
+# Output filename
+wind_eur_flname_output = 'rs_veg_europe_disturbanceWeather_none_event_2000_2018_v1_forwind.parquet'
 
-# Save metadata to a sidecar file
+# Metadata, stored in the GeoParquet file
 metadata = {
     "Filename": wind_eur_flname_output,
     "Variables": "area_ha",
@@ -81,7 +80,34 @@ metadata = {
     "Author names": "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
 }
 
-# Write metadata to a text file
-with open(f'{out_wea_dir}metadata_rs_veg_europe_disturbanceWeather_none_event_2000_2018_v1_forwind.txt', 'w') as f:
-    for key, value in metadata.items():
-        f.write(f"{key}: {value}\n")
+# Save as GeoParquet, sorted by year and location with per-row bbox columns, and with the metadata in the file
+write_geoparquet(wind_final_gdf, f'{out_wea_dir}{wind_eur_flname_output}', metadata, 'EventDate_dt')
+
+# Affected area fraction of the 1km and 0.1 degree grids of the EURO-CORDEX domain for every year with events,
+# so the events can be used with the other gridded layers. Overlapping events of a year are counted once
+grids = {
+    name: target_grid(eur_min_lon, eur_max_lon, eur_min_lat, eur_max_lat, resolution)
+    for name, resolution in target_resolutions.items()
+}
+wind_frac_flname_output = {
+    '1km': 'rs_veg_europe_disturbanceWeatherfraction1km_none_ann_2000_2018_v1_forwind.nc',
+    '0.1deg': 'rs_veg_europe_disturbanceWeatherfraction0p1deg_none_ann_2000_2018_v1_forwind.nc',
+}
+
+frac_attrs = {}
+frac_attrs['Variables'] = 'Severe weather affected area fraction (affected_fraction)'
+frac_attrs['Units'] = 'fraction of the cell area'
+frac_attrs['Data_source'] = 'FORWIND database'
+frac_attrs['Time_period'] = '2000-2018'
+frac_attrs['Time_averaging'] = 'Annual'
+frac_attrs['Spatial_extent'] = 'Europe'
+frac_attrs['Coordinate_system'] = 'EPSG:4326'
+frac_attrs['Author_names'] = 'Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand'
+
+rasterise_events(
+    wind_final_gdf,
+    'EventDate_dt',
+    grids,
+    {name: f'{out_wea_dir}{filename}' for name, filename in wind_frac_flname_output.items()},
+    attrs=frac_attrs,
+)
@@ -3,27 +3,34 @@ __other_citations__ = "Viana-Soto, A., & Senf, C. (2024). European Forest Distur
 __version__ = "1"
 __description__ = "Produces EFMI #5.1 Forest area with damage caused by insects and diseases"
 __inputs__ = "Disturbance agent layer mosaic for Europe, at ~50m resolution, annual for 1985-2023, unitless [presence or absence of disturban agents within cell]"
-__outputs__ = "File named rs_veg_europe_disturbance_none_ann_1985_2023_v1_efda.nc, at ~50m resolution, annual for 1985-2023, with data for undisturbed (0) or disturbed (1) by wind and/or bark beetle complex in the cell"
+__outputs__ = "File named rs_veg_europe_disturbance_none_ann_1985_2023_v1_efda.nc, at ~50m resolution, annual for 1985-2023, with data for undisturbed (0) or disturbed (1) by wind and/or bark beetle complex in the cell. File named rs_veg_europe_disturbancehistory_none_ann_1985_2023_v1_efda.nc with the same data packed into one uint64 bitfield per cell (bit i set if disturbed in 1985 + i). Files named rs_veg_europe_disturbancefraction1km_none_ann_1985_2023_v1_efda.nc and rs_veg_europe_disturbancefraction0p1deg_none_ann_1985_2023_v1_efda.nc, at 1km and 0.1 degree resolution over the EURO-CORDEX domain, annual for 1985-2023, with the disturbed area fraction and disturbed area (ha) of each cell"
 
-import xarray as xr
-import rioxarray as rxr
+import dask.array as dsa
+import numpy as np
+import threading
 import sys
 import os
 import glob
-import gc
+
+from efda_warp import load_or_build_warp_plan, dst_coords, binary_cube
+from disturbance_history import pack_history
+from disturbance_fraction import target_resolutions, target_grid, aggregate_file
+from netcdf_store import create_netcdf
 
 # European Forest Disturbance Atlas (Version 2.1.1.) data for disturbance agents yearly
 path = "/gws/pw/j07/leicester/OPTFOREU/EFMI_EFDA/agents_v211"
-# Path to save yearly processed files
-out_dir = "/gws/pw/j07/leicester/OPTFOREU/EFMI_EFDA/tmp_binary"
-os.makedirs(out_dir, exist_ok=True)
+# Path to save the processed files
+out_dir = "/gws/pw/j07/leicester/OPTFOREU/EFMI_EFDA"
+# Path to keep the warp plan, all the annual mosaics share one grid so it is computed only once
+plan_dir = "/gws/pw/j07/leicester/OPTFOREU/EFMI_EFDA/warp_plan"
 
 years = [str(y) for y in range(1985, 2024)]
 
-# Process each year to avoid running into memory limitations
+infiles = []
+found_years = []
 for year in years:
 
-    matches = glob.glob(f"{path}/{year}*.tif")
+    matches = sorted(glob.glob(f"{path}/{year}*.tif"))
 
     if len(matches) == 0:
         print(f"No file found for {year}, skipping.")
@@ -32,58 +39,92 @@ for year in years:
     if len(matches) > 1:
         print(f"Warning: multiple files found for {year}, using first: {matches[0]}")
 
-    infile = matches[0]
-
-    outfile = f"{out_dir}/{year}.nc"
+    infiles.append(matches[0])
+    found_years.append(year)
 
-    da = rxr.open_rasterio(infile[0]).squeeze()
-    # Reproject from EPSG 3035 to 4326
-    da = da.rio.reproject("EPSG:4326")
-    # Make data binary, where 1 is disburtance by Wind and/or Bark Beetle and the rest is 0 (original data has other disturbances such as fire (2), harvest (3) and mixed agents (4, where more than one agent occurred))
-    da = (da == 1).astype("uint8")
-    da = da.rename("disturbance")
-    da = da.assign_coords(year=year).expand_dims("year")
+# Reproject from EPSG 3035 to 4326 (nearest neighbour, as rio.reproject) with the warp plan of the shared grid
+plan = load_or_build_warp_plan(plan_dir, infiles[0])
+lat, lon = dst_coords(plan)
 
-    da.to_netcdf(outfile)
-    
-    del da
-    gc.collect()
+# Lazy (year, lat, lon) cube in chunks of the destination grid (multiples of the 500x500 output chunks),
+# each chunk reads only the source windows it needs from every year. Data is made binary, where 1 is
+# disburtance by Wind and/or Bark Beetle and the rest is 0 (original data has other disturbances such as
+# fire (2), harvest (3) and mixed agents (4, where more than one agent occurred)), before it is reprojected
+cube = binary_cube(plan, infiles, chunk_size=1000, agent_value=1)
+# Packed history, the years of each cell in one uint64 (bit i set if disturbed in 1985 + i),
+# queried with the functions of disturbance_history.py
+history = cube.map_blocks(pack_history, drop_axis=0, dtype=np.uint64)
 
-    print(f'Processed {year}')
-
-# Combine all years
 da_eur_flname_output = 'rs_veg_europe_disturbance_none_ann_1985_2023_v1_efda.nc'
+da_hist_flname_output = 'rs_veg_europe_disturbancehistory_none_ann_1985_2023_v1_efda.nc'
+
+attrs = {}
+attrs['Filename'] = da_eur_flname_output
+attrs['Variables'] = 'Wind & Bark Beetle Disturbance'
+attrs['Units'] = 'unitless (presence (1) or absence (0))'
+attrs['Data_source'] = 'European Forest Disturbance Atlas (Version 2.1.1.)'
+attrs['Time_period'] = '1985-2023'
+attrs['Time_averaging'] = 'Annual'
+attrs['Spatial_extent'] = 'Europe'
+attrs['Coordinate_system'] = 'EPSG:4326'
+attrs['Author_names'] = 'Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand'
+
+hist_attrs = dict(attrs)
+hist_attrs['Filename'] = da_hist_flname_output
+hist_attrs['Variables'] = 'Wind & Bark Beetle Disturbance history'
+hist_attrs['Units'] = 'bitfield (bit i set if disturbed in 1985 + i)'
+
+# Final files are created up front (compressed to upload and use with more ease) and written chunk by chunk
+nc_eur = create_netcdf(
+    f'{out_dir}/{da_eur_flname_output}',
+    {'year': np.array(found_years), 'lat': lat, 'lon': lon},
+    {"Wind & Bark Beetle Disturbance": {'dims': ('year', 'lat', 'lon'), 'dtype': 'i1', 'chunksizes': (1, 500, 500)}},
+    attrs=attrs,
+)
+nc_hist = create_netcdf(
+    f'{out_dir}/{da_hist_flname_output}',
+    {'lat': lat, 'lon': lon},
+    {"disturbance_history": {
+        'dims': ('lat', 'lon'), 'dtype': 'u8', 'chunksizes': (500, 500),
+        'attrs': {'first_year': int(found_years[0]), 'n_years': len(found_years)},
+    }},
+    attrs=hist_attrs,
+)
 
-files = sorted(glob.glob('/gws/pw/j07/leicester/OPTFOREU/EFMI_EFDA/tmp_binary/*.nc'))
-ds = xr.open_mfdataset(files, combine="nested", concat_dim="year")
-
-# rename coordinates for clarity
-ds = ds.rename({"y": "lat", "x": "lon"})
-ds = ds.drop_vars(["spatial_ref", "band"])
-ds = ds.rename({"disturbance": "Wind & Bark Beetle Disturbance"})
-
-ds.attrs['Filename'] = da_eur_flname_output
-ds.attrs['Variables'] = 'Wind & Bark Beetle Disturbance'
-ds.attrs['Units'] = 'unitless (presence (1) or absence (0))'
-ds.attrs['Data_source'] = 'European Forest Disturbance Atlas (Version 2.1.1.)'
-ds.attrs['Time_period'] = '1985-2023'
-ds.attrs['Time_averaging'] = 'Annual'
-ds.attrs['Spatial_extent'] = 'Europe'
-ds.attrs['Coordinate_system'] = 'EPSG:4326'
-ds.attrs['Author_names'] = 'Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand'
-
-# Compress to upload and use with more ease
-encoding = {
-    "Wind & Bark Beetle Disturbance": {
-        "zlib": True,
-        "complevel": 4,
-        "dtype": "int8",
-        "chunksizes": (1, 500, 500)
-    }
+# Region writes of each chunk into both files, the cube is computed once for both.
+# netCDF4-python is not thread-safe, so writes are serialised
+dsa.store(
+    [cube.astype(np.int8), history],
+    [nc_eur["Wind & Bark Beetle Disturbance"], nc_hist["disturbance_history"]],
+    lock=threading.Lock(),
+)
+nc_eur.close()
+nc_hist.close()
+
+# Disturbed area fraction and disturbed area (ha) on the 1km and 0.1 degree (ERA5-Land) grids of the
+# EURO-CORDEX domain, using the exact area of each ~50m cell, one streaming pass over each year
+eur_min_lon = -44.75
+eur_max_lon = 65.25
+eur_min_lat = 21.75
+eur_max_lat = 72.75
+
+grids = {
+    name: target_grid(eur_min_lon, eur_max_lon, eur_min_lat, eur_max_lat, resolution)
+    for name, resolution in target_resolutions.items()
 }
+da_frac_flname_output = {
+    '1km': 'rs_veg_europe_disturbancefraction1km_none_ann_1985_2023_v1_efda.nc',
+    '0.1deg': 'rs_veg_europe_disturbancefraction0p1deg_none_ann_1985_2023_v1_efda.nc',
+}
+
+frac_attrs = dict(attrs)
+frac_attrs['Variables'] = 'Wind & Bark Beetle disturbed area fraction (disturbed_fraction), disturbed area (disturbed_area)'
+frac_attrs['Units'] = 'fraction of the cell area, ha'
 
-# Save final product
-ds.to_netcdf(
-    f'/gws/pw/j07/leicester/OPTFOREU/EFMI_EFDA/{da_eur_flname_output}',
-    encoding=encoding
+aggregate_file(
+    f'{out_dir}/{da_eur_flname_output}',
+    "Wind & Bark Beetle Disturbance",
+    {name: f'{out_dir}/{filename}' for name, filename in da_frac_flname_output.items()},
+    grids,
+    attrs=frac_attrs,
 )
@@ -13,6 +13,13 @@ import re
 from datetime import datetime
 from geopy.distance import distance
 
+from granule_catalog import open_catalog, query_granules
+from cell_area import grid_cell_area
+from burned_area import burned_area_lut, classify_and_coarsen, coarsen_coords
+from zip_access import open_netcdf
+from subset_cache import cached_subsets
+from netcdf_store import create_netcdf
+
 # Local directory paths to open downloaded data
 out_top_dir = '/data/atsr/OptForEU'
 ba_dir = f'{out_top_dir}/C3S_Burned_Area'
@@ -28,81 +35,72 @@ eur_max_lon = 65.25
 eur_min_lat = 21.75
 eur_max_lat = 72.75
 
-# Search for all downloaded files
-ba_filename_yr = glob.glob(f'{ba_dir}/*/*.nc')
-# Open all files in an xarray
-ba_data = xr.open_mfdataset(ba_filename_yr, engine="netcdf4")
-# Convert time to datetime
-dates = ba_data.time.values
-year_month = dates.astype('datetime64[M]').astype(str)
-# Select the data within the EURO-CORDEX domain
-ba_lat, ba_lon = ba_data.lat.values, ba_data.lon.values
+# Query the catalog for all downloaded monthly files. These are members of the yearly zip archives
+# (/vsizip/ paths), registered by the download script, and are read without extracting them
+catalog = open_catalog(f'{out_top_dir}/granule_catalog.sqlite')
+ba_filename_yr = query_granules(catalog, 'FIRES', start='2017-01-01', end='2022-12-31')
+catalog.close()
+# The EURO-CORDEX subset of each monthly file (land cover only) is read once and kept in the cache as a
+# plain netCDF file, later runs read it from there
+ba_filename_yr = cached_subsets(ba_filename_yr, (eur_min_lon, eur_max_lon, eur_min_lat, eur_max_lat), f'{out_top_dir}/subset_cache', variables=['LC'])
+# Select the data within the EURO-CORDEX domain, as a contiguous window read from each file
+with open_netcdf(ba_filename_yr[0], mask_and_scale=False) as ba_data:
+    ba_lat, ba_lon = ba_data.lat.values, ba_data.lon.values
+    lc_fill_value = ba_data.LC.attrs.get('_FillValue')
 ba_lon_ind_range = np.where((ba_lon >= eur_min_lon) & (ba_lon <= eur_max_lon))[0]
 ba_lat_ind_range = np.where((ba_lat >= eur_min_lat) & (ba_lat <= eur_max_lat))[0]
-# Crop the data to the domain
-ba_data_eur = ba_data.isel(
-                            lat = ba_lat_ind_range,
-                            lon = ba_lon_ind_range
-                            )
-# Save the classification data in two separate variables to get all files and forest fires separately
-ba_data_eur_fire = ba_data_eur.LC
-ba_data_eur_forest_fire = ba_data_eur.LC
-
-ba_data.close()
-
-# Calculate a 2D mask where ANY fires have occurred in the region
-ba_data_eur_fire = ba_data_eur_fire.where(ba_data_eur_fire != 0
-                                         ).notnull()
-# And calculate a 2D mask where FOREST fires have occurred in the region
-ba_data_eur_forest_fire = ba_data_eur_forest_fire.where(
-                                    (
-                                    (ba_data_eur_forest_fire >= 50)
-                                    & (ba_data_eur_forest_fire <= 90))
-                                    | (ba_data_eur_forest_fire == 160)
-                                    | (ba_data_eur_forest_fire == 170)
-                                    ).notnull()
+eur_lat_slice = slice(int(ba_lat_ind_range[0]), int(ba_lat_ind_range[-1]) + 1)
+eur_lon_slice = slice(int(ba_lon_ind_range[0]), int(ba_lon_ind_range[-1]) + 1)
 
+# Lookup table from land cover code to a bitmask of ANY fire and FOREST fire
+# (land cover classes 50-90, 160 and 170)
+lc_lut = burned_area_lut(lc_fill_value)
 # Resample the spatial resolution from 300m to 1km
-ba_data_eur_fire_1km = ba_data_eur_fire.coarsen(lat=3, lon=3, boundary="trim").any()
-ba_data_eur_forest_fire_1km = ba_data_eur_forest_fire.coarsen(lat=3, lon=3, boundary="trim").any()
-
-ds_ba_data_eur_fire_1km = ba_data_eur_fire_1km.to_dataset(name="fires")
-ds_ba_data_eur_fire_1km['forest_fires'] = ba_data_eur_forest_fire_1km
+coarsening_factor = 3
+lat_1km = coarsen_coords(ba_lat[eur_lat_slice], coarsening_factor)
+lon_1km = coarsen_coords(ba_lon[eur_lon_slice], coarsening_factor)
 
-# Caculate area of grid cells
-R = 6371.0 # Earth's radius in kilometers
-# Get lat and lon
-lat_1km_grid = ds_ba_data_eur_fire_1km['lat']
-lon_1km_grid = ds_ba_data_eur_fire_1km['lon']
-# Get lat and lon resolution
-lat_res = np.abs(lat_1km_grid[1] - lat_1km_grid[0])  # Latitude resolution in degrees
-lon_res = np.abs(lon_1km_grid[1] - lon_1km_grid[0])  # Longitude resolution in degrees
-# Convert from degrees to radians
-lat_res_rad = np.deg2rad(lat_res)
-lon_res_rad = np.deg2rad(lon_res)
-# Calculate cell area
-cell_area = (R**2 * lat_res_rad * lon_res_rad * np.cos(np.deg2rad(lat_1km_grid)))
-# Convert cell area to data coordinates
-cell_area_3d = cell_area.broadcast_like(ds_ba_data_eur_fire_1km)
-# Convert units from km2 to hectares
-ds_ba_data_eur_fire_1km['cell_area_ha'] = cell_area_3d * 100
-# Rearrange order of coordinates to match data
-ds_ba_data_eur_fire_1km['cell_area_ha'] = ds_ba_data_eur_fire_1km['cell_area_ha'].transpose('time', 'lat', 'lon')
-
-# Remove metadata from original data
-ds_ba_data_eur_fire_1km.attrs.clear()
 # Output filename
 ba_eur_flname_output = 'rs_veg_europe_fires_none_mon_2010_2021_v1_esacci.nc'
 
 # Metadata
-ds_ba_data_eur_fire_1km.attrs['Filename'] = ba_eur_flname_output
-ds_ba_data_eur_fire_1km.attrs['Variables'] = 'fires, forest_fires, cell_area_ha'
-ds_ba_data_eur_fire_1km.attrs['Units'] = 'ha'
-ds_ba_data_eur_fire_1km.attrs['Data_source'] = 'ECMWF C3S Pixel OLCI Burned Area product'
-ds_ba_data_eur_fire_1km.attrs['Time_period'] = '2017-2022'
-ds_ba_data_eur_fire_1km.attrs['Time_averaging'] = 'Monthly'
-ds_ba_data_eur_fire_1km.attrs['Spatial_extent'] = 'Europe'
-ds_ba_data_eur_fire_1km.attrs['Coordinate_system'] = 'EPSG:4326'
-ds_ba_data_eur_fire_1km.attrs['Author_names'] = 'Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand'
-# Save as a netcdf
-ds_ba_data_eur_fire_1km.to_netcdf(f'{out_ba_dir}/{ba_eur_flname_output}')
+attrs = {}
+attrs['Filename'] = ba_eur_flname_output
+attrs['Variables'] = 'fires, forest_fires, cell_area_ha'
+attrs['Units'] = 'ha'
+attrs['Data_source'] = 'ECMWF C3S Pixel OLCI Burned Area product'
+attrs['Time_period'] = '2017-2022'
+attrs['Time_averaging'] = 'Monthly'
+attrs['Spatial_extent'] = 'Europe'
+attrs['Coordinate_system'] = 'EPSG:4326'
+attrs['Author_names'] = 'Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand'
+
+# The output file is created up front and the masks where ANY fires and FOREST fires have occurred in
+# each 1km cell are written one month at a time, so only one month is held in memory. The masks are
+# stored as uint8 flagged as bool, so they open as bool as before
+mask_variable = {'dims': ('time', 'lat', 'lon'), 'dtype': 'u1', 'chunksizes': (1, 500, 500), 'attrs': {'dtype': 'bool'}}
+nc_fires = create_netcdf(
+    f'{out_ba_dir}/{ba_eur_flname_output}',
+    {'time': np.zeros(len(ba_filename_yr), dtype=np.int64), 'lat': lat_1km, 'lon': lon_1km},
+    {
+        'fires': mask_variable,
+        'forest_fires': mask_variable,
+        'cell_area_ha': {'dims': ('lat', 'lon'), 'dtype': 'f8', 'chunksizes': (500, 500)},
+    },
+    attrs=attrs,
+)
+nc_fires['time'].setncatts({'units': 'days since 1970-01-01', 'calendar': 'standard'})
+
+for i, ba_filename in enumerate(ba_filename_yr):
+    with open_netcdf(ba_filename, mask_and_scale=False) as ba_data:
+        # Read the uint8 land cover of the domain once, then classify and coarsen it in one pass
+        lc_eur = ba_data.LC.isel(time=0, lat=eur_lat_slice, lon=eur_lon_slice).values
+        fires_month, forest_fires_month = classify_and_coarsen(lc_eur, lc_lut, coarsening_factor)
+        nc_fires['fires'][i, :, :] = fires_month
+        nc_fires['forest_fires'][i, :, :] = forest_fires_month
+        nc_fires['time'][i] = (ba_data.time.values[0] - np.datetime64('1970-01-01', 'ns')) // np.timedelta64(1, 'D')
+
+# Calculate the exact (WGS84 ellipsoid) area of the grid cells in hectares. It is the same for every
+# month, so it is stored once as a 2D (lat, lon) variable
+nc_fires['cell_area_ha'][:, :] = grid_cell_area(lat_1km, lon_1km, units='ha')
+nc_fires.close()
@@ -4,7 +4,7 @@ __other_citations__ = "European Commission Directorate-General Joint Research Ce
 __version__ = "1"
 __description__ = "Produces EFMI #11 Leaf Area Index. Resamples spatial resolution, resampled temporal resolution and subsets to the EURO CORDEX region domain"
 __inputs__ = "Copernicus Global Land Service LAI dataset, at 300m resolution, 10-daily for 2014 to present, unitless. Note that data was used From January 2014 to August 2016 based upon RT5 PROBA-V and to June 2020 based upon RT0 PROBA-V data with version 1.0 and from July 2020 onwards based upon RT0 Sentinel-3/OLCI data with version 1.1. RT0 is the Near Real Time product while RT5 is the final consolidated Real Time product."
-__outputs__ = "File named rs_veg_europe_lai_none_mon_2014_2024_v1_clms.nc, at 1km resolution, monthly from January 2014 to December 2023, unitless"
+__outputs__ = "File named rs_veg_europe_lai_none_mon_2014_2024_v1_clms.nc, at 1km resolution, monthly from January 2014 to December 2023, unitless. With write_pyramid_levels, file named rs_veg_europe_lai_multiscale_mon_2014_2024_v1_clms.nc with the 1km, 5km, 10km and 0.1 degree levels as groups"
 
 from matplotlib import pyplot as plt
 import xarray as xr
@@ -21,6 +21,11 @@ import datetime
 from IPython import embed
 from netCDF4 import Dataset
 
+from granule_catalog import open_catalog, query_granules
+from subset_cache import cached_subsets
+from block_reduce import coarsen_dataarray
+from pyramid import write_pyramid
+
 # Local path to directory where downloaded data has been saved
 var_dir = '/data/atsr/OptForEU/CopernicusLand/LAI/'
 # Local path to directory where output will be saved
@@ -28,6 +33,11 @@ out_dir_top = '/data/atsr/OptForEU/CLMS_LAI'
 out_dir = f'{out_dir_top}/Europe/input/remote_sensing/vegetation/'
 if not os.path.exists(out_dir):
      os.makedirs(out_dir)
+# Local path to directory where the EURO-CORDEX subsets of the global files are cached
+subset_cache_dir = '/data/atsr/OptForEU/subset_cache'
+
+# Catalog of downloaded files, filled in by the download script
+catalog = open_catalog()
 
 # EURO-CORDEX Domain
 min_lon_eur = -44.75
@@ -59,15 +69,19 @@ for i in range(var_times.size):
 
     mn = var_times[i]
 
+    mn_end = mn + pd.offsets.MonthEnd(0)
     if mn in rt5_var_times:
-        var_files = sorted(glob('%s/c_gls_LAI300_%i%02d*.nc' % (var_dir, mn.year, mn.month)))
+        var_files = query_granules(catalog, 'LAI', start=mn, end=mn_end, group='RT5')
     elif mn in rt0_probav_var_times:
-        var_files = sorted(glob('%s/c_gls_LAI300-RT0_%i%02d*_PROBAV_*.nc' % (var_dir, mn.year, mn.month)))
+        var_files = query_granules(catalog, 'LAI', start=mn, end=mn_end, group='RT0', sensor='PROBAV')
     elif mn in rt0_olci_var_times:
-        var_files = sorted(glob('%s/c_gls_LAI300-RT0_%i%02d*_OLCI_*.nc' % (var_dir, mn.year, mn.month)))
+        var_files = query_granules(catalog, 'LAI', start=mn, end=mn_end, group='RT0', sensor='OLCI')
     else:
         print('Month not within range of the timestamp for RT0 and RT5 programmed')
 
+    # The EURO-CORDEX subset of each global file is read once and kept in the cache, later runs read it from there
+    var_files = cached_subsets(var_files, (min_lon_eur, max_lon_eur, min_lat_eur, max_lat_eur), subset_cache_dir, variables=['LAI'])
+
     # Open datasets
     var_data = xr.open_mfdataset(var_files, combine = 'nested', concat_dim = [pd.Index(np.arange(len(var_files)), name = 'time'),])
 
@@ -82,7 +96,7 @@ for i in range(var_times.size):
     var_data_subset = da_month_mean_lai.isel(lon=slice(int(var_lon_in_range[0]), int(var_lon_in_range[-1])+1), lat=slice(int(var_lat_in_range[0]), int(var_lat_in_range[-1])+1)) # , time = 0)
     # Resample spatial resolution from 333m to 1km
     coarsening_factor = 1000 // 333
-    var_data_coarsen = var_data_subset['LAI'].coarsen(lon=coarsening_factor, lat=coarsening_factor, boundary = "pad").mean()
+    var_data_coarsen = coarsen_dataarray(var_data_subset['LAI'], coarsening_factor, ('mean',), boundary='pad')['mean'].rename('LAI')
 
     month = mn.strftime("%m")
     time_mn_yr = f'{mn.year}-{month}'
@@ -90,6 +104,8 @@ for i in range(var_times.size):
     monthly_averages.append(var_data_coarsen)
     yr_mn_list.append(time_mn_yr)
 
+catalog.close()
+
 # Join all months in a dataset
 combined_dataset = xr.concat(monthly_averages, dim='time')
 combined_dataset = combined_dataset.assign_coords(time=yr_mn_list)
@@ -109,3 +125,15 @@ combined_dataset.attrs['Coordinate_system'] = 'EPSG:4326'
 combined_dataset.attrs['Author_names'] = 'Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand'
 
 combined_dataset.to_netcdf(f'{out_dir}{lai_out_filename}')
+
+# Coarser 5km, 10km and 0.1 degree levels, reduced in cascade from the 1km output in one pass and saved
+# with it as the groups of one multiscale file
+write_pyramid_levels = True
+if write_pyramid_levels:
+    lai_pyr_filename = 'rs_veg_europe_lai_multiscale_mon_2014_2024_v1_clms.nc'
+    with xr.open_dataset(f'{out_dir}{lai_out_filename}', chunks={}) as lai_1km:
+        write_pyramid(
+            f'{out_dir}{lai_pyr_filename}',
+            lai_1km['LAI'],
+            attrs=dict(lai_1km.attrs, Filename=lai_pyr_filename),
+        )
@@ -19,14 +19,18 @@ import os
 import logging
 import sys
 
+from subset_cache import cached_subsets
+
 def process_month(this_year, month_n, p_terra_modis, tod='DAY'):
     # Find daily files for daytime
     terra_modis_daily_files = glob(f'{p_terra_modis}{this_year}/{month_n}/*/*{tod}*.nc')
+    # The EURO-CORDEX subset of each global file (lst only) is read once and kept in the cache, later runs read it from there
+    terra_modis_daily_files = cached_subsets(terra_modis_daily_files, (min_lon_eur, max_lon_eur, min_lat_eur, max_lat_eur), subset_cache_dir, variables=['lst'])
 
     # Open data and get monthly mean
     with xr.open_mfdataset(terra_modis_daily_files, engine='netcdf4') as terra_daily_data_og:
         # Remove unnecessary variables
-        terra_daily_data_lst = terra_daily_data_og.drop_vars(list_vars_drop)
+        terra_daily_data_lst = terra_daily_data_og.drop_vars(list_vars_drop, errors='ignore')
         # Crop to European domain
         terra_daily_data_eur = terra_daily_data_lst.sel(
                                     lat=slice(min_lat_eur, max_lat_eur),
@@ -70,6 +74,8 @@ for slurm_arr_yr in date_list:
     #out_data_topdir = '/data/atsr/OptForEU/ESACCI_LST'
     if not os.path.exists(out_data_topdir):
         os.makedirs(out_data_topdir)
+    # Local path to directory in JASMIN where the EURO-CORDEX subsets of the global files are cached
+    subset_cache_dir = '/gws/pw/j07/leicester/OPTFOREU/subset_cache'
 
     # EURO-CORDEX Domain
     min_lon_eur = -44.75
@@ -0,0 +1,38 @@
+__author__ = "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
+__version__ = "1"
+__description__ = "Extracts the time series of the forest inventory plots from every layer of the harmonised EURO-CORDEX datacube (satellite EFMIs and EURO-CORDEX projections). The cell of each plot is found once by index arithmetic on the 0.1 degree grid, and the plots are grouped by chunk of the datacube so that each chunk is read only once"
+__inputs__ = "File named rs_veg_europe_datacube_none_mon_1963_2100_v1_optforeu.nc (output of Process_Satellite_EURO-CORDEX_EFMI-Datacube_1963_2100_Monthly.py), CSV file of the plot coordinates with columns plot_id, lat and lon (EPSG:4326)"
+__outputs__ = "One file per layer named rs_veg_europe_<layer>_plots_1963_2100_v1_optforeu.parquet, a tidy table with one row per plot and time step (and model and scenario for the projections), with columns point (plot_id), model, scenario, time or year, and the value of the layer"
+
+import os
+
+import pandas as pd
+import xarray as xr
+
+from point_extract import extract_points
+
+out_top_dir = '/data/atsr/OptForEU'
+cube_file = f'{out_top_dir}/Datacube/Europe/input/rs_veg_europe_datacube_none_mon_1963_2100_v1_optforeu.nc'
+# Coordinates of the forest inventory plots
+plots_file = f'{out_top_dir}/Plots/plot_coordinates.csv'
+
+out_plots_dir = f'{out_top_dir}/Plots/Europe/input/'
+os.makedirs(out_plots_dir, exist_ok=True)
+
+plots = pd.read_csv(plots_file)
+
+# Every layer of the datacube
+with xr.open_dataset(cube_file) as ds:
+    layers = [name for name in ds.data_vars if ds[name].dims[-2:] == ('lat', 'lon')]
+
+# The cells of the plots are found once and shared by all the layers
+tables = extract_points(cube_file, layers, plots['lat'].values, plots['lon'].values, point_ids=plots['plot_id'].values)
+
+for name, table in tables.items():
+    table.attrs = {
+        'Filename': f'rs_veg_europe_{name}_plots_1963_2100_v1_optforeu.parquet',
+        'Data_source': cube_file,
+        'Coordinate_system': 'EPSG:4326',
+        'Author_names': 'Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand',
+    }
+    table.to_parquet(f'{out_plots_dir}/rs_veg_europe_{name}_plots_1963_2100_v1_optforeu.parquet', index=False)
@@ -0,0 +1,47 @@
+__author__ = "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
+__version__ = "1"
+__description__ = "Chunk plans for coarsening a bbox of global gridded files with dask. The bbox is a contiguous index range trimmed to whole coarsening blocks, and the dask chunks of each axis follow the on-disk (HDF5) chunking while their edges inside the bbox fall on block boundaries, so every chunk is read from whole disk chunks and reduced on its own."
+
+import numpy as np
+
+# Approximate dask chunk length along each spatial axis, rounded to whole disk chunks
+target_chunk = 4000
+
+def bbox_slice(coord, min_value, max_value, factor=1):
+    # Contiguous index range of a monotonic coordinate within [min_value, max_value], trimmed at the end
+    # to a whole number of factor-sized blocks (as coarsen(boundary="trim"))
+    inside = np.flatnonzero((coord >= min_value) & (coord <= max_value))
+    start = int(inside[0])
+    n_blocks = (int(inside[-1]) + 1 - start) // factor
+    return slice(start, start + n_blocks * factor)
+
+def disk_chunks(path, variable):
+    # On-disk chunk length of each dimension of a variable, the whole dimension if it is not chunked
+    import netCDF4
+
+    with netCDF4.Dataset(path) as nc:
+        var = nc[variable]
+        chunking = var.chunking()
+        if chunking == 'contiguous':
+            chunking = var.shape
+        return dict(zip(var.dimensions, (int(size) for size in chunking)))
+
+def axis_chunks(size, window, disk_chunk, factor, target=target_chunk):
+    # Dask chunk lengths of a whole axis. Outside the window they are whole disk chunks; the window
+    # starts and ends on chunk edges and its inner edges are the first block boundaries at or after
+    # the disk-aligned edges, so each chunk holds whole blocks and only spills into a neighbouring
+    # disk chunk by less than one block
+    step = max(1, round(target / disk_chunk)) * disk_chunk
+    start, stop = window.start, window.stop
+    edges = np.arange(step, size, step)
+
+    inner = edges[(edges > start) & (edges < stop)]
+    inner = start + -(-(inner - start) // factor) * factor
+    bounds = np.unique(np.concatenate([
+        [0, start, stop, size], edges[edges < start], inner[inner < stop], edges[edges > stop],
+    ]))
+    return tuple(int(length) for length in np.diff(bounds))
+
+def coarse_coord(coord, window, factor):
+    # Block means of a coordinate over the window, the coordinate coarsen().mean() gives
+    return coord[window].reshape(-1, factor).mean(axis=1)
@@ -0,0 +1,249 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Shared block reduction for the resolution changes of the satellite products. The last two (lat, lon) axes of a NumPy or dask array are viewed as blocks with a reshape (integer factors) or gathered with the exact overlap of each source pixel with each output cell (non-integer factors, padded edges), and several NaN/nodata-aware statistics (mean, sum, count, fraction_valid, any, min, max, mode) are computed from one valid mask in one pass."
+
+import numpy as np
+
+block_statistics = ('mean', 'sum', 'count', 'fraction_valid', 'any', 'min', 'max', 'mode')
+
+# Tolerance on factor arithmetic, so that e.g. 3.0000000001 is treated as 3
+factor_tolerance = 1e-9
+
+def pair(factor):
+    return tuple(factor) if isinstance(factor, (tuple, list)) else (factor, factor)
+
+def is_integer_factor(factor):
+    return abs(factor - round(factor)) < factor_tolerance
+
+def n_output_cells(n, factor, boundary='trim'):
+    # Whole output cells only ('trim', as coarsen(boundary="trim")) or also the last partial one ('pad')
+    if boundary == 'trim':
+        return int(np.floor(n / factor + factor_tolerance))
+    if boundary == 'pad':
+        return int(np.ceil(n / factor - factor_tolerance))
+    raise ValueError(f'Unknown boundary: {boundary}')
+
+def overlap_weights(n, factor, n_out, shift=0):
+    # Source pixels overlapping each output cell along one axis of n source pixels, (n_out, k) indices
+    # and the length of their overlap with the cell (in source pixels). Cell j covers
+    # [shift + j * factor, shift + (j + 1) * factor)
+    starts = shift + np.arange(n_out) * factor
+    first = np.floor(starts + factor_tolerance).astype(np.intp)
+    index = first[:, None] + np.arange(int(np.ceil(factor)) + 1)
+
+    low = np.maximum(index, starts[:, None])
+    high = np.minimum(np.minimum(index + 1, starts[:, None] + factor), n)
+    weights = np.clip(high - low, 0, None)
+    weights[weights < factor_tolerance] = 0
+
+    return np.minimum(index, n - 1), weights
+
+def axis_weights(n, factor, boundary='trim'):
+    return overlap_weights(n, factor, n_output_cells(n, factor, boundary))
+
+def block_view(data, factor, boundary='trim'):
+    # (..., n_rows, k_rows, n_cols, k_cols) blocks of the last two axes and their overlap weights, None
+    # when every pixel counts fully. Integer factors with trimmed edges are a reshape of data (no copy)
+    row_factor, col_factor = pair(factor)
+    n_rows, n_cols = data.shape[-2:]
+
+    if boundary == 'trim' and is_integer_factor(row_factor) and is_integer_factor(col_factor):
+        row_factor, col_factor = int(round(row_factor)), int(round(col_factor))
+        n_out_rows, n_out_cols = n_rows // row_factor, n_cols // col_factor
+        trimmed = data[..., :n_out_rows * row_factor, :n_out_cols * col_factor]
+        return trimmed.reshape(data.shape[:-2] + (n_out_rows, row_factor, n_out_cols, col_factor)), None
+
+    row_index, row_weights = axis_weights(n_rows, row_factor, boundary)
+    col_index, col_weights = axis_weights(n_cols, col_factor, boundary)
+    blocks = data[..., row_index[:, :, None, None], col_index[None, None, :, :]]
+    weights = row_weights[:, :, None, None] * col_weights[None, None, :, :]
+    return blocks, weights
+
+def valid_mask(blocks, nodata_values=None):
+    valid = ~np.isnan(blocks) if blocks.dtype.kind == 'f' else np.ones(blocks.shape, dtype=bool)
+    if nodata_values is not None:
+        valid &= ~np.isin(blocks, nodata_values)
+    return valid
+
+def block_mode(blocks, valid, weights):
+    # Most frequent valid value of each block (largest total overlap for fractional blocks), the smallest
+    # value on ties. Values of a block are sorted and the weight of each run of equal values is summed
+    shape = blocks.shape
+    n = shape[-3] * shape[-1]
+    out_shape = shape[:-3] + (shape[-2],)
+
+    def flat(array):
+        array = np.broadcast_to(array, shape)
+        return np.moveaxis(array, -3, -2).reshape(out_shape + (n,))
+
+    values = flat(np.where(valid, blocks, np.nan).astype(np.float64))
+    run_weights = flat(valid if weights is None else valid * weights).astype(np.float64)
+
+    order = np.argsort(values, axis=-1, kind='stable')
+    values = np.take_along_axis(values, order, axis=-1)
+    run_weights = np.take_along_axis(run_weights, order, axis=-1)
+
+    positions = np.arange(n)
+    new_run = np.ones(values.shape, dtype=bool)
+    new_run[..., 1:] = values[..., 1:] != values[..., :-1]
+    run_start = np.maximum.accumulate(np.where(new_run, positions, 0), axis=-1)
+    cumulative = np.cumsum(run_weights, axis=-1)
+    before = np.where(run_start > 0, np.take_along_axis(cumulative, np.maximum(run_start - 1, 0), axis=-1), 0)
+    run_total = np.where(np.isnan(values), 0, cumulative - before)
+
+    best = np.argmax(run_total, axis=-1)[..., None]
+    mode = np.take_along_axis(values, best, axis=-1)[..., 0]
+    mode[np.take_along_axis(run_total, best, axis=-1)[..., 0] <= 0] = np.nan
+    return mode
+
+def reduce_blocks(blocks, weights, statistics, nodata_values=None, dtype=None):
+    # Statistics of every block from one valid mask. Empty blocks are NaN (False for 'any')
+    dtype = dtype or np.result_type(blocks.dtype, np.float32)
+    axes = (-3, -1)
+    valid = valid_mask(blocks, nodata_values)
+    present = valid if weights is None else valid & (weights > 0)
+    weighted_valid = valid if weights is None else valid * weights
+
+    count = weighted_valid.sum(axis=axes, dtype=np.float64)
+    empty = ~present.any(axis=axes)
+    reduced = {}
+
+    if 'sum' in statistics or 'mean' in statistics:
+        values = np.where(valid, blocks, 0)
+        sums = (values if weights is None else values * weights).sum(axis=axes, dtype=np.float64)
+        if 'sum' in statistics:
+            reduced['sum'] = np.where(empty, np.nan, sums).astype(dtype)
+        if 'mean' in statistics:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                reduced['mean'] = np.where(empty, np.nan, sums / count).astype(dtype)
+    if 'count' in statistics:
+        reduced['count'] = count.astype(dtype)
+    if 'fraction_valid' in statistics:
+        total = np.prod([blocks.shape[axis] for axis in axes]) if weights is None else weights.sum(axis=axes)
+        reduced['fraction_valid'] = (count / total).astype(dtype)
+    if 'any' in statistics:
+        reduced['any'] = (present & (blocks != 0)).any(axis=axes)
+    if 'min' in statistics:
+        reduced['min'] = np.where(empty, np.nan, np.where(present, blocks, np.inf).min(axis=axes)).astype(dtype)
+    if 'max' in statistics:
+        reduced['max'] = np.where(empty, np.nan, np.where(present, blocks, -np.inf).max(axis=axes)).astype(dtype)
+    if 'mode' in statistics:
+        reduced['mode'] = block_mode(blocks, present, weights).astype(dtype)
+
+    return reduced
+
+def check_statistics(statistics):
+    unknown = [statistic for statistic in statistics if statistic not in block_statistics]
+    if unknown:
+        raise ValueError(f'Unknown statistics: {unknown}')
+
+def block_reduce_numpy(data, factor, statistics=('mean',), nodata_values=None, boundary='trim'):
+    check_statistics(statistics)
+    blocks, weights = block_view(np.asarray(data), factor, boundary)
+    return reduce_blocks(blocks, weights, statistics, nodata_values=nodata_values)
+
+def block_reduce_dask(data, factor, statistics=('mean',), nodata_values=None, boundary='trim'):
+    # Chunks holding whole blocks are reduced independently with map_blocks (the statistics stacked on
+    # a new first axis); otherwise each output tile is reduced from the source slice it overlaps
+    import dask.array as dsa
+    from dask import delayed
+
+    check_statistics(statistics)
+    row_factor, col_factor = pair(factor)
+    dtype = np.result_type(data.dtype, np.float32)
+    names = list(statistics)
+
+    def stacked(block):
+        reduced = block_reduce_numpy(block, factor, names, nodata_values=nodata_values, boundary=boundary)
+        return np.stack([reduced[name].astype(dtype) for name in names])
+
+    aligned = (
+        boundary == 'trim' and is_integer_factor(row_factor) and is_integer_factor(col_factor)
+        and all(size % int(round(row_factor)) == 0 for size in data.chunks[-2])
+        and all(size % int(round(col_factor)) == 0 for size in data.chunks[-1])
+    )
+    if aligned:
+        row_factor, col_factor = int(round(row_factor)), int(round(col_factor))
+        chunks = ((len(names),),) + data.chunks[:-2] + (
+            tuple(size // row_factor for size in data.chunks[-2]),
+            tuple(size // col_factor for size in data.chunks[-1]),
+        )
+        result = data.map_blocks(stacked, new_axis=0, chunks=chunks, dtype=dtype)
+    else:
+        n_rows = n_output_cells(data.shape[-2], row_factor, boundary)
+        n_cols = n_output_cells(data.shape[-1], col_factor, boundary)
+        # Output tiles holding about one source chunk each
+        tile_rows = max(1, int(round(max(data.chunks[-2]) / row_factor)))
+        tile_cols = max(1, int(round(max(data.chunks[-1]) / col_factor)))
+
+        rows = []
+        for row in range(0, n_rows, tile_rows):
+            row_stop = min(row + tile_rows, n_rows)
+            cols = []
+            for col in range(0, n_cols, tile_cols):
+                col_stop = min(col + tile_cols, n_cols)
+                tile = tile_reduce(data, row, row_stop, col, col_stop, row_factor, col_factor, names, nodata_values, dtype, delayed)
+                cols.append(dsa.from_delayed(tile, (len(names),) + data.shape[:-2] + (row_stop - row, col_stop - col), dtype=dtype))
+            rows.append(cols)
+        result = dsa.block(rows)
+
+    reduced = {name: result[i] for i, name in enumerate(names)}
+    if 'any' in reduced:
+        reduced['any'] = reduced['any'].astype(bool)
+    return reduced
+
+def tile_reduce(data, row, row_stop, col, col_stop, row_factor, col_factor, names, nodata_values, dtype, delayed):
+    # Output cells [row, row_stop) x [col, col_stop) from the source pixels they overlap
+    src_row = int(np.floor(row * row_factor + factor_tolerance))
+    src_row_stop = min(data.shape[-2], int(np.ceil(row_stop * row_factor - factor_tolerance)))
+    src_col = int(np.floor(col * col_factor + factor_tolerance))
+    src_col_stop = min(data.shape[-1], int(np.ceil(col_stop * col_factor - factor_tolerance)))
+    # Offset of the output cells from the first source pixel, as a fraction of a pixel
+    row_shift, col_shift = row * row_factor - src_row, col * col_factor - src_col
+
+    def reduce_tile(block):
+        row_index, row_weights = overlap_weights(block.shape[-2], row_factor, row_stop - row, shift=row_shift)
+        col_index, col_weights = overlap_weights(block.shape[-1], col_factor, col_stop - col, shift=col_shift)
+        blocks = block[..., row_index[:, :, None, None], col_index[None, None, :, :]]
+        weights = row_weights[:, :, None, None] * col_weights[None, None, :, :]
+        reduced = reduce_blocks(blocks, weights, names, nodata_values=nodata_values, dtype=dtype)
+        return np.stack([reduced[name].astype(dtype) for name in names])
+
+    return delayed(reduce_tile)(data[..., src_row:src_row_stop, src_col:src_col_stop])
+
+def block_reduce(data, factor, statistics=('mean',), nodata_values=None, boundary='trim'):
+    # Reduce the last two axes of data by factor (one factor, or (row_factor, col_factor)). Returns a
+    # dict of statistic -> array, lazy when data is a dask array
+    if hasattr(data, 'dask'):
+        return block_reduce_dask(data, factor, statistics, nodata_values=nodata_values, boundary=boundary)
+    return block_reduce_numpy(data, factor, statistics, nodata_values=nodata_values, boundary=boundary)
+
+def block_coord(coord, factor, boundary='trim'):
+    # Coordinate of each output cell: the block mean coarsen() gives for integer factors, the centre of
+    # the part of the cell covered by the source (a regular grid) for non-integer factors
+    index, weights = axis_weights(coord.size, factor, boundary)
+    if is_integer_factor(factor):
+        return (coord[index] * weights).sum(axis=1) / weights.sum(axis=1)
+
+    starts = np.arange(index.shape[0]) * factor
+    centres = (starts + np.minimum(starts + factor, coord.size)) / 2
+    step = (coord[-1] - coord[0]) / (coord.size - 1)
+    return coord[0] + (centres - 0.5) * step
+
+def coarsen_dataarray(da, factor, statistics=('mean',), nodata_values=None, boundary='trim', lat_name='lat', lon_name='lon'):
+    # Block reduction of an xarray DataArray over (lat, lon), as a Dataset with one variable per statistic
+    import xarray as xr
+
+    row_factor, col_factor = pair(factor)
+    dims = [dim for dim in da.dims if dim not in (lat_name, lon_name)] + [lat_name, lon_name]
+    da = da.transpose(*dims)
+    reduced = block_reduce(da.data, (row_factor, col_factor), statistics, nodata_values=nodata_values, boundary=boundary)
+
+    coords = {dim: da[dim] for dim in dims[:-2] if dim in da.coords}
+    coords[lat_name] = (lat_name, block_coord(da[lat_name].values, row_factor, boundary), da[lat_name].attrs)
+    coords[lon_name] = (lon_name, block_coord(da[lon_name].values, col_factor, boundary), da[lon_name].attrs)
+    # Statistics in the units of the data keep its attributes, as coarsen() does
+    return xr.Dataset(
+        {name: (dims, data, da.attrs if name in ('mean', 'min', 'max', 'mode') else {}) for name, data in reduced.items()},
+        coords=coords,
+    )
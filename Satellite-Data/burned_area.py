@@ -0,0 +1,40 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Single-pass classification and 3x3 block reduction of the C3S pixel burned area land cover (LC) layer. LC codes are mapped through a 256-entry lookup table to a small bitmask, which is OR-reduced over blocks with a reshape, giving both 'fires' and 'forest_fires' from one read of each month."
+
+import numpy as np
+
+from block_reduce import block_view
+
+# Bits of the burned area bitmask
+any_fire_bit = 1
+forest_fire_bit = 2
+
+# Land cover classes counted as forest: tree cover classes 50-90 and the flooded tree cover classes 160 and 170
+forest_lc_classes = list(range(50, 91)) + [160, 170]
+
+def burned_area_lut(fill_value=None):
+    # Bitmask of each uint8 LC code. 0 means the pixel did not burn, any other code is the land
+    # cover of a burned pixel. The fill value (if any) is treated as not burned
+    lut = np.full(256, any_fire_bit, dtype=np.uint8)
+    lut[0] = 0
+    lut[forest_lc_classes] |= forest_fire_bit
+    if fill_value is not None:
+        lut[int(fill_value)] = 0
+    return lut
+
+def block_or(bitmask, factor):
+    # Bitwise OR over factor x factor blocks with a reshape, trimming rows/columns that do not
+    # fill a whole block (as coarsen(boundary="trim"))
+    blocks, _ = block_view(bitmask, factor)
+    return np.bitwise_or.reduce(np.bitwise_or.reduce(blocks, axis=-1), axis=-2)
+
+def classify_and_coarsen(lc, lut, factor=3):
+    # One pass over a uint8 LC array: lookup, block OR, then split the bits into the two masks
+    coarse = block_or(lut[lc], factor)
+    return (coarse & any_fire_bit) != 0, (coarse & forest_fire_bit) != 0
+
+def coarsen_coords(coord, factor):
+    # Block mean of a 1D coordinate, matching the coordinates given by coarsen(boundary="trim")
+    n_blocks = coord.size // factor
+    return coord[:n_blocks * factor].reshape(n_blocks, factor).mean(axis=1)
@@ -0,0 +1,62 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Exact WGS84 ellipsoid areas of the cells of regular lat/lon grids, vectorised per grid and memoised by grid fingerprint, shared by the FIRES and SoilCarbon scripts."
+
+import hashlib
+
+import numpy as np
+
+# WGS84 ellipsoid
+wgs84_a = 6378137.0
+wgs84_f = 1 / 298.257223563
+wgs84_e2 = wgs84_f * (2 - wgs84_f)
+wgs84_e = np.sqrt(wgs84_e2)
+
+# Conversion from m2 to the units the EFMI products are written in
+area_units = {
+    'm2': 1.0,
+    'ha': 1e-4,
+    'km2': 1e-6,
+}
+
+# Areas already computed in this session, by grid fingerprint
+cell_area_cache = {}
+
+def authalic_q(lat_deg):
+    # q(lat) of the ellipsoid, the area between two latitudes per radian of longitude
+    # is a**2 / 2 * (q(lat2) - q(lat1))
+    sin_lat = np.sin(np.radians(lat_deg))
+    return (1 - wgs84_e2) * (
+        sin_lat / (1 - wgs84_e2 * sin_lat ** 2)
+        - np.log((1 - wgs84_e * sin_lat) / (1 + wgs84_e * sin_lat)) / (2 * wgs84_e)
+    )
+
+def cell_edges(centres):
+    # Cell edges half way between the centres, the first and last cells are assumed to be as wide as
+    # their neighbour. Works for ascending and descending coordinates
+    centres = np.asarray(centres, dtype=np.float64)
+    mids = (centres[:-1] + centres[1:]) / 2
+    first = centres[0] - (mids[0] - centres[0])
+    last = centres[-1] + (centres[-1] - mids[-1])
+    return np.concatenate([[first], mids, [last]])
+
+def latitude_band_areas(lat_edges):
+    # Area in m2 of each latitude band per radian of longitude
+    return wgs84_a ** 2 / 2 * np.abs(np.diff(authalic_q(np.clip(lat_edges, -90, 90))))
+
+def grid_fingerprint(lat, lon):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    return hashlib.sha1(lat.tobytes() + b'|' + lon.tobytes()).hexdigest()
+
+def grid_cell_area(lat, lon, units='m2'):
+    # (lat, lon) array with the exact ellipsoidal area of each cell of a lat/lon grid given by its
+    # 1-D cell centres. The area only depends on the latitude band and the longitude width, so it
+    # is the outer product of two 1-D arrays
+    key = (grid_fingerprint(lat, lon), units)
+    if key not in cell_area_cache:
+        band_areas = latitude_band_areas(cell_edges(lat))
+        lon_widths = np.radians(np.abs(np.diff(cell_edges(lon))))
+        cell_area_cache[key] = np.outer(band_areas, lon_widths) * area_units[units]
+
+    return cell_area_cache[key]
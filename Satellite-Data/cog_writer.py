@@ -0,0 +1,70 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Writes the raster EFMI products as Cloud Optimized GeoTIFFs: internal 512x512 tiles, DEFLATE or ZSTD compression with a predictor and precomputed overviews, so that viewers and windowed readers can fetch a region or a coarse overview without decoding the whole European mosaic."
+
+import os
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.io import MemoryFile
+
+# Internal tile size of the outputs
+cog_blocksize = 512
+
+def tiled_profile(profile, blocksize=cog_blocksize):
+    # Uncompressed tiled GeoTIFF profile, used for outputs that are written window by window before
+    # being converted to COG (compressed tiles written in pieces would be rewritten and waste space)
+    profile = dict(profile)
+    profile.update({
+        "driver": 'GTiff',
+        "tiled": True,
+        "blockxsize": blocksize,
+        "blockysize": blocksize,
+    })
+    for key in ('compress', 'predictor', 'interleave'):
+        profile.pop(key, None)
+    return profile
+
+def to_cog(src_path, dst_path, compress='DEFLATE', blocksize=cog_blocksize, overview_resampling='average', remove_src=False):
+    # Copy a raster to a COG. Overviews are computed down to a single tile, the predictor is chosen by
+    # GDAL from the data type (horizontal differencing for integers, floating point for floats). Band
+    # tags and nodata are copied with the data
+    rasterio.shutil.copy(
+        src_path,
+        dst_path,
+        driver='COG',
+        BLOCKSIZE=blocksize,
+        COMPRESS=compress,
+        PREDICTOR='YES',
+        OVERVIEWS='IGNORE_EXISTING',
+        OVERVIEW_RESAMPLING=overview_resampling.upper(),
+        BIGTIFF='IF_SAFER',
+    )
+    if remove_src:
+        os.remove(src_path)
+    return dst_path
+
+def write_cog(path, data, profile, tags=None, compress='DEFLATE', overview_resampling='average'):
+    # Write a 2D array (or a (band, y, x) stack) with its rasterio profile and band tags as a COG
+    data = np.asarray(data)
+    if data.ndim == 2:
+        data = data[np.newaxis]
+
+    profile = tiled_profile(profile)
+    profile.update({
+        "count": data.shape[0],
+        "height": data.shape[1],
+        "width": data.shape[2],
+        "dtype": data.dtype.name,
+    })
+
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as mem:
+            mem.write(data)
+            if tags:
+                for band in range(1, data.shape[0] + 1):
+                    mem.update_tags(band, **tags)
+        to_cog(memfile.name, path, compress=compress, overview_resampling=overview_resampling)
+
+    return path
@@ -0,0 +1,201 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Assembly of the harmonised EURO-CORDEX analysis datacube. Every satellite and projection layer is regridded to one common regular lat/lon grid (the 0.1 degree ERA5-Land grid) with area-conservative weights that are built once per source grid and cached on disk. Time coordinates are normalised (months as datetimes, years as integers) and all layers are written into one chunked multi-variable netCDF file."
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from cell_area import authalic_q, cell_edges
+from ease_grid import overlap_matrix
+from netcdf_store import create_netcdf
+
+# Chunks of the datacube variables along each dimension
+datacube_chunks = {'model': 1, 'scenario': 1, 'time': 12, 'year': 1, 'lat': 170, 'lon': 220}
+
+# Time steps regridded and written together
+time_batch = 12
+
+# Time encoding of the monthly axis in the file
+time_units = 'days since 1970-01-01'
+
+def latlon_weights(source_lat, source_lon, target_lat, target_lon):
+    # Exact area-conservative weights between two regular lat/lon grids, one sparse matrix per axis:
+    # the overlap in q (proportional to area) along latitude and in degrees along longitude. Rows are
+    # target cells, columns source cells
+    lat_weights = overlap_matrix(authalic_q(cell_edges(target_lat)), authalic_q(cell_edges(source_lat)))
+    lon_weights = overlap_matrix(cell_edges(target_lon), cell_edges(source_lon))
+    return lat_weights, lon_weights
+
+def weights_fingerprint(source_lat, source_lon, target_lat, target_lon):
+    key = repr((
+        np.round(source_lat, 6).tolist(), np.round(source_lon, 6).tolist(),
+        np.round(target_lat, 6).tolist(), np.round(target_lon, 6).tolist(),
+    ))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def load_or_build_latlon_weights(cache_dir, source_lat, source_lon, target_lat, target_lon):
+    # The weights only depend on the grids, so build them once and keep them on disk
+    os.makedirs(cache_dir, exist_ok=True)
+    fingerprint = weights_fingerprint(source_lat, source_lon, target_lat, target_lon)
+    cache_files = [f'{cache_dir}/latlon_weights_{fingerprint}_{axis}.npz' for axis in ('lat', 'lon')]
+
+    if all(os.path.exists(cache_file) for cache_file in cache_files):
+        return tuple(sparse.load_npz(cache_file) for cache_file in cache_files)
+
+    weights = latlon_weights(source_lat, source_lon, target_lat, target_lon)
+    for cache_file, axis_weights in zip(cache_files, weights):
+        sparse.save_npz(cache_file, axis_weights)
+
+    return weights
+
+def source_window(weights):
+    # Rows and columns of the source that overlap the target grid, the only part that is read
+    lat_weights, lon_weights = weights
+    rows = np.flatnonzero(lat_weights.getnnz(axis=0))
+    cols = np.flatnonzero(lon_weights.getnnz(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        raise ValueError('The source grid does not overlap the target grid')
+    return slice(int(rows[0]), int(rows[-1]) + 1), slice(int(cols[0]), int(cols[-1]) + 1)
+
+def regrid(weights, window, data):
+    # Regrid a (time, y, x) stack of the source window. NaNs are left out and the weights renormalised,
+    # target cells not covered by any valid source cell are NaN
+    lat_weights = weights[0][:, window[0]]
+    lon_weights = weights[1][:, window[1]]
+    regridded = np.full((data.shape[0], lat_weights.shape[0], lon_weights.shape[0]), np.nan, dtype=np.float32)
+
+    for i, step in enumerate(data):
+        valid = np.isfinite(step)
+        weighted_sum = lon_weights @ (lat_weights @ np.where(valid, step, 0).astype(np.float64)).T
+        weight_total = lon_weights @ (lat_weights @ valid.astype(np.float64)).T
+        np.divide(weighted_sum.T, weight_total.T, out=regridded[i], where=weight_total.T > 0, casting='unsafe')
+
+    return regridded
+
+def time_parts(values):
+    # (year, month) of each time value, whether integer years, 'YYYY-MM'/'YYYY' strings, periods,
+    # datetimes or cftime dates
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        return values.astype(int), np.ones(values.size, dtype=int)
+    if values.dtype.kind == 'M':
+        dates = pd.DatetimeIndex(values)
+        return dates.year.to_numpy(), dates.month.to_numpy()
+
+    years, months = [], []
+    for value in values:
+        if not hasattr(value, 'year'):
+            value = pd.Period(str(value))
+        years.append(value.year)
+        months.append(getattr(value, 'month', 1))
+    return np.array(years), np.array(months)
+
+def normalise_time(values, frequency):
+    # Months as month-start datetime64, years as integers
+    years, months = time_parts(values)
+    if frequency == 'annual':
+        return years.astype(np.int32)
+    if frequency == 'monthly':
+        return np.array([f'{year:04d}-{month:02d}' for year, month in zip(years, months)], dtype='datetime64[M]').astype('datetime64[ns]')
+    raise ValueError(f'Unknown frequency: {frequency}')
+
+def layer_sources(spec):
+    # (ensemble member, path) of every file of a layer, the member is () outside ensembles
+    if 'ensemble' in spec:
+        return list(spec['ensemble'].items())
+    paths = [spec['path']] if isinstance(spec['path'], str) else spec['path']
+    return [((), path) for path in paths]
+
+def open_source(path, spec):
+    # Lazy (time, lat, lon) DataArray of one file of a layer. GeoTIFFs hold one time step, given by
+    # the 'time' of the layer spec. GeoTIFFs in a projected CRS (e.g. the EPSG:3035 TCD change maps,
+    # whatever their coordinate_system tag says) are first warped to EPSG:4326 by averaging
+    import xarray as xr
+
+    if path.endswith('.tif'):
+        import rioxarray
+        from rasterio.enums import Resampling
+
+        da = rioxarray.open_rasterio(path, masked=True).isel(band=0, drop=True)
+        if da.rio.crs is None:
+            raise ValueError(f'{path} has no CRS')
+        da = da.astype(np.float32).rio.write_nodata(np.nan, encoded=False)
+        if not da.rio.crs.is_geographic:
+            da = da.rio.reproject('EPSG:4326', resampling=Resampling.average)
+        elif da.rio.crs.to_epsg() != 4326:
+            raise ValueError(f'{path} is not in EPSG:4326 ({da.rio.crs})')
+        da = da.rename({'y': 'lat', 'x': 'lon'}).expand_dims(time=[spec['time'][path]])
+        return da.drop_vars('spatial_ref', errors='ignore')
+
+    ds = xr.open_dataset(path)
+    lat_name = spec.get('lat_name', 'latitude' if 'latitude' in ds.dims else 'lat')
+    lon_name = spec.get('lon_name', 'longitude' if 'longitude' in ds.dims else 'lon')
+    da = ds[spec['variable']].rename({spec.get('time_dim', 'time'): 'time', lat_name: 'lat', lon_name: 'lon'})
+    return da.transpose('time', 'lat', 'lon')
+
+def layer_times(layers):
+    # Union of the normalised time steps of all the layers, per frequency
+    times = {'monthly': set(), 'annual': set()}
+    for spec in layers.values():
+        for _, path in layer_sources(spec):
+            with open_source(path, spec) as da:
+                times[spec['frequency']].update(normalise_time(da['time'].values, spec['frequency']).tolist())
+    return np.array(sorted(times['monthly']), dtype='datetime64[ns]'), np.array(sorted(times['annual']), dtype=np.int32)
+
+def datacube_variables(layers, coords, ensemble_dims):
+    # One float variable per layer, ensembles have the leading ensemble dimensions
+    sizes = {dim: len(values) for dim, values in coords.items()}
+    variables = {}
+    for name, spec in layers.items():
+        time_dim = 'time' if spec['frequency'] == 'monthly' else 'year'
+        dims = (tuple(ensemble_dims) if 'ensemble' in spec else ()) + (time_dim, 'lat', 'lon')
+        variables[name] = {
+            'dims': dims,
+            'dtype': 'f4',
+            'chunksizes': tuple(min(datacube_chunks[dim], sizes[dim]) for dim in dims),
+            'fill_value': np.float32(np.nan),
+            'attrs': spec.get('attrs', {}),
+        }
+    return variables
+
+def assemble_datacube(path, layers, target_lat, target_lon, cache_dir, ensemble_coords=None, attrs=None):
+    # layers: {name: spec}, with 'frequency' ('monthly' or 'annual') and either 'path' (one path or a
+    # list) or, for ensembles, 'ensemble' {(model, scenario, ...): path}; netCDF files give 'variable'
+    # (and 'time_dim', 'lat_name', 'lon_name' if not time, lat/latitude, lon/longitude), GeoTIFFs give
+    # 'time' {path: time}. Every layer is regridded to the target grid and written to one variable
+    ensemble_coords = ensemble_coords or {}
+    months, years = layer_times(layers)
+
+    coords = dict(ensemble_coords)
+    if months.size:
+        coords['time'] = (months - np.datetime64('1970-01-01', 'ns')) // np.timedelta64(1, 'D')
+    if years.size:
+        coords['year'] = years
+    coords.update({'lat': target_lat, 'lon': target_lon})
+
+    nc = create_netcdf(path, coords, datacube_variables(layers, coords, ensemble_coords), attrs=attrs)
+    if months.size:
+        nc['time'].setncatts({'units': time_units, 'calendar': 'standard'})
+
+    try:
+        for name, spec in layers.items():
+            axis = months if spec['frequency'] == 'monthly' else years
+            for member, source_path in layer_sources(spec):
+                member_index = tuple(list(ensemble_coords[dim]).index(label) for dim, label in zip(ensemble_coords, member))
+                with open_source(source_path, spec) as da:
+                    weights = load_or_build_latlon_weights(cache_dir, da['lat'].values, da['lon'].values, target_lat, target_lon)
+                    window = source_window(weights)
+                    positions = np.searchsorted(axis, normalise_time(da['time'].values, spec['frequency']))
+
+                    for start in range(0, positions.size, time_batch):
+                        stop = min(start + time_batch, positions.size)
+                        data = da.isel(time=slice(start, stop), lat=window[0], lon=window[1]).values.astype(np.float32)
+                        nc[name][member_index + (positions[start:stop].tolist(),)] = regrid(weights, window, data)
+    finally:
+        nc.close()
+
+    return path
@@ -0,0 +1,116 @@
+__author__ = "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
+__version__ = "1"
+__description__ = "Aggregation of the ~50m EFDA presence/absence of disturbance to coarse regular lat/lon grids (1km and the ERA5-Land 0.1 degree grid) as the disturbed area fraction and disturbed hectares of each cell. Each fine cell is given its exact WGS84 area and assigned to the coarse cell holding its centre, and the sums are vectorised segment reductions (np.add.reduceat) over bands of rows, in one streaming pass over each year."
+
+import numpy as np
+import xarray as xr
+
+from cell_area import area_units, cell_edges, latitude_band_areas
+from ease_grid import regular_grid
+from netcdf_store import create_netcdf
+
+# Target grids over the EURO-CORDEX domain, resolution in degrees
+target_resolutions = {
+    '1km': 1 / 120,
+    '0.1deg': 0.1,
+}
+
+def target_grid(min_lon, max_lon, min_lat, max_lat, resolution):
+    # Cell centres of the target grid (ascending), with its origin and resolution for the index arithmetic
+    lon, lat = regular_grid(min_lon, max_lon, min_lat, max_lat, resolution)
+    return {'lat': lat, 'lon': lon, 'min_lat': min_lat, 'min_lon': min_lon, 'resolution': resolution}
+
+def target_index(centres, min_value, resolution, n_cells):
+    # Target cell of each source coordinate, -1 outside the target grid
+    index = np.floor((np.asarray(centres, dtype=np.float64) - min_value) / resolution).astype(np.intp)
+    index[(index < 0) | (index >= n_cells)] = -1
+    return index
+
+def segment_sum(values, index, axis):
+    # Sum values over the runs of equal target index along an axis. The source coordinates are
+    # monotonic, so every target cell is a single run; runs outside the target grid are dropped
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(index)) + 1])
+    sums = np.add.reduceat(values, starts, axis=axis, dtype=np.float64)
+    keep = np.flatnonzero(index[starts] >= 0)
+    return np.take(sums, keep, axis=axis), index[starts][keep]
+
+def aggregate_band(binary, lat, lon, grid):
+    # Disturbed and covered area (m2) of the target cells touched by a band of source rows.
+    # binary is (rows, cols) presence/absence on a regular lat/lon grid given by its centres
+    row_area = latitude_band_areas(cell_edges(lat)) * np.radians(abs(lon[1] - lon[0]))
+    rows = target_index(lat, grid['min_lat'], grid['resolution'], grid['lat'].size)
+    cols = target_index(lon, grid['min_lon'], grid['resolution'], grid['lon'].size)
+
+    # Number of disturbed cells per source row and target column, then area-weighted sum over rows
+    counts, target_cols = segment_sum(binary, cols, axis=1)
+    disturbed, target_rows = segment_sum(counts * row_area[:, None], rows, axis=0)
+
+    # Covered area only depends on the grids
+    n_cols = segment_sum(np.ones(cols.size), cols, axis=0)[0]
+    covered, _ = segment_sum(np.outer(row_area, n_cols), rows, axis=0)
+
+    return target_rows, target_cols, disturbed, covered
+
+def aggregate_year(read_band, lat, lon, grids, band_rows=4000):
+    # One streaming pass over the rows of one year. read_band(start, stop) returns the source rows
+    # start:stop. Returns the disturbed and covered area (m2) on each target grid
+    disturbed = {name: np.zeros((grid['lat'].size, grid['lon'].size)) for name, grid in grids.items()}
+    covered = {name: np.zeros((grid['lat'].size, grid['lon'].size)) for name, grid in grids.items()}
+
+    for start in range(0, lat.size, band_rows):
+        stop = min(start + band_rows, lat.size)
+        binary = read_band(start, stop)
+        for name, grid in grids.items():
+            target_rows, target_cols, band_disturbed, band_covered = aggregate_band(binary, lat[start:stop], lon, grid)
+            # Target rows at the edge of a band can also get cells from the next band, so add up
+            disturbed[name][np.ix_(target_rows, target_cols)] += band_disturbed
+            covered[name][np.ix_(target_rows, target_cols)] += band_covered
+
+    return disturbed, covered
+
+def aggregate_file(source_path, variable, out_paths, grids, attrs=None, band_rows=4000):
+    # Disturbed area fraction and disturbed hectares of each target cell and year, written year by
+    # year (region writes) into one file per target grid
+    source = xr.open_dataset(source_path, chunks={})
+    data = source[variable]
+    lat = source['lat'].values
+    lon = source['lon'].values
+    years = [int(year) for year in source['year'].values]
+
+    outputs = {}
+    for name, grid in grids.items():
+        chunk_lat, chunk_lon = min(grid['lat'].size, 500), min(grid['lon'].size, 500)
+        outputs[name] = create_netcdf(
+            out_paths[name],
+            {'year': np.array(years, dtype=np.int32), 'lat': grid['lat'], 'lon': grid['lon']},
+            {
+                'disturbed_fraction': {
+                    'dims': ('year', 'lat', 'lon'), 'dtype': 'f4', 'chunksizes': (1, chunk_lat, chunk_lon),
+                    'fill_value': np.float32(np.nan), 'attrs': {'units': 'fraction of the cell area'},
+                },
+                'disturbed_area': {
+                    'dims': ('year', 'lat', 'lon'), 'dtype': 'f4', 'chunksizes': (1, chunk_lat, chunk_lon),
+                    'fill_value': np.float32(np.nan), 'attrs': {'units': 'ha'},
+                },
+            },
+            attrs=dict(attrs or {}, Filename=out_paths[name].split('/')[-1]),
+        )
+
+    try:
+        for i, year in enumerate(years):
+            def read_band(start, stop):
+                return data[i, start:stop, :].values
+
+            disturbed, covered = aggregate_year(read_band, lat, lon, grids, band_rows=band_rows)
+            for name, nc in outputs.items():
+                fraction = np.full(covered[name].shape, np.nan, dtype=np.float32)
+                np.divide(disturbed[name], covered[name], out=fraction, where=covered[name] > 0, casting='unsafe')
+                area_ha = np.where(covered[name] > 0, disturbed[name] * area_units['ha'], np.nan).astype(np.float32)
+                nc['disturbed_fraction'][i, :, :] = fraction
+                nc['disturbed_area'][i, :, :] = area_ha
+    finally:
+        for nc in outputs.values():
+            nc.close()
+        source.close()
+
+    return out_paths
@@ -0,0 +1,101 @@
+__author__ = "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
+__version__ = "1"
+__description__ = "Bit-packed disturbance histories. The annual presence/absence of disturbance of each pixel is packed into one uint64 (bit i set if the pixel was disturbed in first_year + i), and per-pixel queries (first/last disturbance year, number of disturbances, disturbed within a window, years since last disturbance) are vectorised popcount and bit-scan operations, so they run chunk by chunk over the whole of Europe."
+
+import numpy as np
+import xarray as xr
+
+# Value of the year queries for pixels that were never disturbed
+no_disturbance = -1
+
+# Number of set bits of each byte, used when numpy has no bitwise_count (numpy < 2.0)
+byte_popcount = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+def pack_history(binary, axis=0):
+    # Pack a presence/absence array along the year axis into uint64 bitfields, bit i is year i
+    binary = np.moveaxis(np.asarray(binary), axis, 0)
+    if binary.shape[0] > 64:
+        raise ValueError(f'At most 64 years fit in a uint64 history, got {binary.shape[0]}')
+
+    history = np.zeros(binary.shape[1:], dtype=np.uint64)
+    for bit, year_binary in enumerate(binary):
+        history |= (year_binary != 0).astype(np.uint64) << np.uint64(bit)
+    return history
+
+def unpack_history(history, n_years):
+    # Inverse of pack_history, (year, ...) uint8 array
+    bits = np.arange(n_years, dtype=np.uint64).reshape((n_years,) + (1,) * np.ndim(history))
+    return ((np.asarray(history, dtype=np.uint64) >> bits) & np.uint64(1)).astype(np.uint8)
+
+def count_disturbances(history):
+    # Number of years in which each pixel was disturbed (popcount)
+    history = np.asarray(history, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(history)
+    as_bytes = history.view(np.uint8).reshape(history.shape + (8,))
+    return byte_popcount[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+def lowest_bit(history):
+    # Index of the lowest set bit, -1 where no bit is set. The lowest bit is isolated with
+    # x & -x, a power of two that frexp gives exactly
+    history = np.asarray(history, dtype=np.uint64)
+    isolated = history & (~history + np.uint64(1))
+    index = np.frexp(isolated.astype(np.float64))[1].astype(np.int16) - 1
+    return np.where(history == 0, np.int16(-1), index)
+
+def highest_bit(history):
+    # Index of the highest set bit, -1 where no bit is set. frexp of the float value gives the bit
+    # length, corrected where the conversion to float64 rounded up to the next power of two
+    history = np.asarray(history, dtype=np.uint64)
+    index = np.minimum(np.frexp(history.astype(np.float64))[1].astype(np.int16) - 1, 63)
+    rounded_up = (history >> np.maximum(index, 0).astype(np.uint64)) == 0
+    index = np.where(rounded_up, index - 1, index)
+    return np.where(history == 0, np.int16(-1), index)
+
+def first_disturbance_year(history, first_year):
+    bit = lowest_bit(history)
+    return np.where(bit < 0, np.int16(no_disturbance), bit + np.int16(first_year))
+
+def last_disturbance_year(history, first_year):
+    bit = highest_bit(history)
+    return np.where(bit < 0, np.int16(no_disturbance), bit + np.int16(first_year))
+
+def year_window_mask(start_year, end_year, first_year):
+    # Bits of the years start_year to end_year (both included)
+    start_bit = max(start_year - first_year, 0)
+    end_bit = min(end_year - first_year, 63)
+    if end_bit < start_bit:
+        return np.uint64(0)
+    n_bits = end_bit - start_bit + 1
+    bits = np.uint64(0xFFFFFFFFFFFFFFFF) if n_bits == 64 else np.uint64((1 << n_bits) - 1)
+    return bits << np.uint64(start_bit)
+
+def disturbed_in_window(history, start_year, end_year, first_year):
+    # True where the pixel was disturbed in any year from start_year to end_year (both included)
+    return (np.asarray(history, dtype=np.uint64) & year_window_mask(start_year, end_year, first_year)) != 0
+
+def years_since_last_disturbance(history, reference_year, first_year):
+    # Years between the last disturbance up to reference_year and reference_year, -1 if none
+    before = np.asarray(history, dtype=np.uint64) & year_window_mask(first_year, reference_year, first_year)
+    last = last_disturbance_year(before, first_year)
+    return np.where(last < 0, np.int16(no_disturbance), np.int16(reference_year) - last)
+
+def open_history(path, chunks=None):
+    # History variable of a packed file as a (dask backed, if chunks is given) DataArray, with its first year
+    ds = xr.open_dataset(path, chunks=chunks)
+    history = ds['disturbance_history']
+    return history, int(history.attrs['first_year'])
+
+def query_history(history, query, output_dtype=np.int16, **kwargs):
+    # Apply a query function chunk by chunk over a (dask backed) history DataArray, e.g.
+    # query_history(history, first_disturbance_year, first_year=1985)
+    return xr.apply_ufunc(query, history, kwargs=kwargs, dask='parallelized', output_dtypes=[output_dtype])
+
+def pack_dataarray(binary, year_dim='year'):
+    # Pack a (year, lat, lon) presence/absence DataArray chunk by chunk, the year dimension in one chunk
+    if binary.chunks is not None:
+        binary = binary.chunk({year_dim: -1})
+    return xr.apply_ufunc(
+        pack_history, binary, input_core_dims=[[year_dim]], kwargs={'axis': -1},
+        dask='parallelized', output_dtypes=[np.uint64]
+    )
@@ -0,0 +1,114 @@
+__author__ = "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
+__version__ = "1"
+__description__ = "Area-conservative regridding from the SMAP EASE-Grid 2.0 (9 km) to a regular lat/lon grid. The sparse weight matrix is built once from the grid definitions, cached on disk and applied to all monthly maps as one sparse matrix product."
+
+import hashlib
+import os
+
+import numpy as np
+from scipy import sparse
+
+from cell_area import wgs84_a, wgs84_e2, authalic_q, cell_edges
+
+# EASE-Grid 2.0 global (EPSG:6933) is a cylindrical equal-area projection with true scale at 30 degrees
+ease2_lat_ts = np.radians(30.0)
+ease2_k0 = np.cos(ease2_lat_ts) / np.sqrt(1 - wgs84_e2 * np.sin(ease2_lat_ts) ** 2)
+
+# 9 km global grid (M09) used by the SMAP L4 products
+ease2_m09_cell_size = 9008.055210146
+ease2_m09_ncols = 3856
+ease2_m09_nrows = 1624
+
+def ease2_edges(window, cell_size=ease2_m09_cell_size, ncols=ease2_m09_ncols, nrows=ease2_m09_nrows):
+    # Column edges in longitude and row edges in q for the rows/columns of a window of the global grid.
+    # Rows go from north to south, as in the SMAP files
+    row_slice, col_slice = window
+    x_edges = (np.arange(col_slice.start, col_slice.stop + 1) - ncols / 2) * cell_size
+    y_edges = (nrows / 2 - np.arange(row_slice.start, row_slice.stop + 1)) * cell_size
+
+    lon_edges = np.degrees(x_edges / (wgs84_a * ease2_k0))
+    q_edges = 2 * ease2_k0 * y_edges / wgs84_a
+
+    return lon_edges, q_edges
+
+def ease2_centres(window, **grid):
+    # Cell centre latitude/longitude of the window, used to check the grid against the file coordinates
+    lon_edges, q_edges = ease2_edges(window, **grid)
+    lon_centres = (lon_edges[:-1] + lon_edges[1:]) / 2
+    q_centres = (q_edges[:-1] + q_edges[1:]) / 2
+    # Invert q(lat) by interpolation on a fine table, q is monotonic in latitude
+    lat_table = np.linspace(-90, 90, 1800001)
+    lat_centres = np.interp(q_centres, authalic_q(lat_table), lat_table)
+
+    return lat_centres, lon_centres
+
+def regular_grid(min_lon, max_lon, min_lat, max_lat, resolution):
+    # Cell centres of a regular lat/lon grid whose cells exactly cover the bounding box
+    lon = min_lon + resolution * (np.arange(int(round((max_lon - min_lon) / resolution))) + 0.5)
+    lat = min_lat + resolution * (np.arange(int(round((max_lat - min_lat) / resolution))) + 0.5)
+    return np.round(lon, 6), np.round(lat, 6)
+
+def overlap_matrix(target_edges, source_edges):
+    # Length of the overlap between each target and source interval along one axis, as a sparse
+    # (n_target, n_source) matrix. Both edge arrays may be ascending or descending
+    t_lo = np.minimum(target_edges[:-1], target_edges[1:])
+    t_hi = np.maximum(target_edges[:-1], target_edges[1:])
+    s_lo = np.minimum(source_edges[:-1], source_edges[1:])
+    s_hi = np.maximum(source_edges[:-1], source_edges[1:])
+
+    overlap = np.minimum(t_hi[:, None], s_hi[None, :]) - np.maximum(t_lo[:, None], s_lo[None, :])
+    overlap = np.clip(overlap, 0, None)
+
+    return sparse.csr_matrix(overlap)
+
+def build_weights(window, target_lon, target_lat):
+    # Exact area-conservative weights. Both grids are made of lon/lat rectangles, so the overlap area of
+    # two cells is (overlap in longitude) * (overlap in q) and the weight matrix is the Kronecker
+    # product of one matrix per axis. Rows are target cells (lat, lon), columns source cells (y, x)
+    source_lon_edges, source_q_edges = ease2_edges(window)
+    target_q_edges = authalic_q(cell_edges(target_lat))
+
+    lon_overlap = overlap_matrix(cell_edges(target_lon), source_lon_edges)
+    q_overlap = overlap_matrix(target_q_edges, source_q_edges)
+
+    return sparse.kron(q_overlap, lon_overlap, format='csr')
+
+def weights_fingerprint(window, target_lon, target_lat):
+    key = repr((
+        window[0].start, window[0].stop, window[1].start, window[1].stop,
+        target_lon.round(6).tolist(), target_lat.round(6).tolist(), ease2_m09_cell_size
+    ))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def load_or_build_weights(cache_dir, window, target_lon, target_lat, source_lat=None, source_lon=None):
+    # The weights only depend on the grids, so build them once and keep them on disk
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = f'{cache_dir}/ease2_m09_to_latlon_{weights_fingerprint(window, target_lon, target_lat)}.npz'
+    if os.path.exists(cache_file):
+        return sparse.load_npz(cache_file)
+
+    # Check that the grid definition matches the coordinates read from the files
+    if source_lat is not None and source_lon is not None:
+        lat_centres, lon_centres = ease2_centres(window)
+        if not (np.allclose(source_lat, lat_centres[:, None], atol=1e-3) and np.allclose(source_lon, lon_centres[None, :], atol=1e-3)):
+            raise ValueError('Source coordinates do not match the EASE-Grid 2.0 9 km grid definition')
+
+    weights = build_weights(window, target_lon, target_lat)
+    sparse.save_npz(cache_file, weights)
+
+    return weights
+
+def apply_weights(weights, data, target_shape):
+    # Regrid a (time, y, x) stack in one sparse matrix product. NaNs are left out and the weights
+    # renormalised, target cells not covered by any valid source cell are NaN
+    n_time = data.shape[0]
+    flat = data.reshape(n_time, -1).T
+    valid = np.isfinite(flat)
+
+    weighted_sum = weights @ np.where(valid, flat, 0).astype(np.float64)
+    weight_total = weights @ valid.astype(np.float64)
+
+    regridded = np.full(weighted_sum.shape, np.nan, dtype=np.float32)
+    np.divide(weighted_sum, weight_total, out=regridded, where=weight_total > 0, casting='unsafe')
+
+    return regridded.T.reshape((n_time,) + tuple(target_shape))
@@ -0,0 +1,180 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Reproject-once warp plan for the European Forest Disturbance Atlas annual mosaics, which all share one EPSG:3035 grid. The EPSG:4326 destination grid and the source position of a coarse lattice of destination pixels are computed once and cached; per-pixel source index maps are interpolated from the lattice and every year is warped with a nearest-neighbour gather of its binarised uint8 layer."
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import rasterio
+from rasterio.warp import calculate_default_transform, transform
+from rasterio.windows import Window
+
+# Spacing in destination pixels of the lattice on which the exact transformation is computed. The
+# transformation is smooth, so linear interpolation between nodes is far below a pixel
+lattice_step = 16
+
+def plan_fingerprint(src_crs, src_transform, src_shape, dst_crs, step):
+    key = repr((str(src_crs), tuple(src_transform)[:6], tuple(src_shape), str(dst_crs), step))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def build_warp_plan(src_path, dst_crs='EPSG:4326', step=lattice_step):
+    # Destination grid as given by rio.reproject (calculate_default_transform) and the fractional
+    # source row/column of the destination pixel centres on the lattice nodes
+    with rasterio.open(src_path) as src:
+        src_crs, src_transform, src_shape = src.crs, src.transform, (src.height, src.width)
+        dst_transform, dst_width, dst_height = calculate_default_transform(
+            src.crs, dst_crs, src.width, src.height, *src.bounds
+        )
+
+    # Nodes every step pixels, the last node is at or beyond the last pixel
+    node_rows = np.arange(0, dst_height - 1 + step, step, dtype=np.float64)
+    node_cols = np.arange(0, dst_width - 1 + step, step, dtype=np.float64)
+    dst_x = dst_transform.c + (node_cols + 0.5) * dst_transform.a
+    dst_y = dst_transform.f + (node_rows + 0.5) * dst_transform.e
+    grid_x, grid_y = np.meshgrid(dst_x, dst_y)
+
+    # Same coordinate operation as GDAL uses in rio.reproject, so that nearest picks the same pixels
+    src_x, src_y = transform(dst_crs, src_crs, grid_x.ravel(), grid_y.ravel())
+    lattice_cols, lattice_rows = ~src_transform * (np.reshape(src_x, grid_x.shape), np.reshape(src_y, grid_y.shape))
+
+    return {
+        "src_crs": str(src_crs),
+        "src_transform": tuple(src_transform)[:6],
+        "src_shape": src_shape,
+        "dst_crs": str(dst_crs),
+        "dst_transform": tuple(dst_transform)[:6],
+        "dst_shape": (dst_height, dst_width),
+        "step": step,
+        "lattice_rows": np.asarray(lattice_rows),
+        "lattice_cols": np.asarray(lattice_cols),
+    }
+
+def load_or_build_warp_plan(cache_dir, src_path, dst_crs='EPSG:4326', step=lattice_step):
+    # The plan only depends on the source grid, so build it once and keep it on disk
+    os.makedirs(cache_dir, exist_ok=True)
+    with rasterio.open(src_path) as src:
+        fingerprint = plan_fingerprint(src.crs, src.transform, (src.height, src.width), dst_crs, step)
+    cache_file = f'{cache_dir}/efda_warp_plan_{fingerprint}.npz'
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            plan = json.loads(str(cached['grid']))
+            plan['lattice_rows'] = cached['lattice_rows']
+            plan['lattice_cols'] = cached['lattice_cols']
+        return plan
+
+    plan = build_warp_plan(src_path, dst_crs=dst_crs, step=step)
+    grid = {key: value for key, value in plan.items() if not key.startswith('lattice')}
+    np.savez(cache_file, grid=json.dumps(grid), lattice_rows=plan['lattice_rows'], lattice_cols=plan['lattice_cols'])
+
+    return plan
+
+def check_source_grid(plan, src):
+    # Every year must be on the grid the plan was built for
+    if (str(src.crs) != plan['src_crs'] or tuple(src.transform)[:6] != tuple(plan['src_transform'])
+            or (src.height, src.width) != tuple(plan['src_shape'])):
+        raise ValueError(f'{src.name} is not on the grid of the warp plan')
+
+def dst_coords(plan):
+    # Destination pixel centres (lat, lon) for a north-up EPSG:4326 grid
+    a, _, c, _, e, f = plan['dst_transform']
+    dst_height, dst_width = plan['dst_shape']
+    lon = c + (np.arange(dst_width) + 0.5) * a
+    lat = f + (np.arange(dst_height) + 0.5) * e
+    return lat, lon
+
+def interpolate_lattice(lattice, rows, cols, step):
+    # Bilinear interpolation of a lattice array at destination rows/cols (1D, a tensor grid). The few
+    # lattice rows the window needs are interpolated along columns first, then along rows
+    row_pos, col_pos = rows / step, cols / step
+    r0 = np.minimum(np.floor(row_pos).astype(np.intp), lattice.shape[0] - 2)
+    c0 = np.minimum(np.floor(col_pos).astype(np.intp), lattice.shape[1] - 2)
+    tr = (row_pos - r0)[:, None]
+    tc = (col_pos - c0)[None, :]
+
+    first_row = r0.min()
+    nodes = lattice[first_row:r0.max() + 2]
+    along_cols = nodes[:, c0] * (1 - tc) + nodes[:, c0 + 1] * tc
+    return along_cols[r0 - first_row] * (1 - tr) + along_cols[r0 - first_row + 1] * tr
+
+def index_map(plan, window):
+    # Source row and column of each destination pixel of a window, -1 where it falls outside the source
+    rows = np.arange(window.row_off, window.row_off + window.height, dtype=np.float64)
+    cols = np.arange(window.col_off, window.col_off + window.width, dtype=np.float64)
+
+    src_rows = np.floor(interpolate_lattice(plan['lattice_rows'], rows, cols, plan['step'])).astype(np.int32)
+    src_cols = np.floor(interpolate_lattice(plan['lattice_cols'], rows, cols, plan['step'])).astype(np.int32)
+
+    src_height, src_width = plan['src_shape']
+    outside = (src_rows < 0) | (src_rows >= src_height) | (src_cols < 0) | (src_cols >= src_width)
+    src_rows[outside] = -1
+    src_cols[outside] = -1
+
+    return src_rows, src_cols
+
+def source_window(src_rows, src_cols):
+    # Smallest source window holding all the pixels an index map points to, None if it points to none
+    valid = src_rows >= 0
+    if not valid.any():
+        return None
+    row_min, row_max = src_rows[valid].min(), src_rows[valid].max()
+    col_min, col_max = src_cols[valid].min(), src_cols[valid].max()
+    return Window(int(col_min), int(row_min), int(col_max - col_min + 1), int(row_max - row_min + 1))
+
+def gather(data, src_rows, src_cols, row_off=0, col_off=0, fill_value=0):
+    # Nearest neighbour warp of a source array (or a source window starting at row_off/col_off)
+    warped = np.full(src_rows.shape, fill_value, dtype=data.dtype)
+    valid = src_rows >= 0
+    warped[valid] = data[src_rows[valid] - row_off, src_cols[valid] - col_off]
+    return warped
+
+def warp_array(plan, data, fill_value=0, band_rows=1024):
+    # Warp a whole source array to the destination grid, one band of destination rows at a time
+    dst_height, dst_width = plan['dst_shape']
+    warped = np.full((dst_height, dst_width), fill_value, dtype=data.dtype)
+
+    for row_off in range(0, dst_height, band_rows):
+        window = Window(0, row_off, dst_width, min(band_rows, dst_height - row_off))
+        src_rows, src_cols = index_map(plan, window)
+        warped[row_off:row_off + window.height] = gather(data, src_rows, src_cols, fill_value=fill_value)
+
+    return warped
+
+def warp_block(plan, paths, window, agent_value=1):
+    # Presence (1) / absence (0) of one disturbance agent for all years in one destination window,
+    # (year, rows, cols) uint8. The index map is computed once and reused for every year, and
+    # every year only reads the source window the destination window needs
+    src_rows, src_cols = index_map(plan, window)
+    src_window = source_window(src_rows, src_cols)
+    block = np.zeros((len(paths), int(window.height), int(window.width)), dtype=np.uint8)
+    if src_window is None:
+        return block
+
+    for i, path in enumerate(paths):
+        with rasterio.open(path) as src:
+            # Binarise before the warp, so only uint8 data is gathered
+            binary = (src.read(1, window=src_window) == agent_value).astype(np.uint8)
+        block[i] = gather(binary, src_rows, src_cols, row_off=src_window.row_off, col_off=src_window.col_off)
+
+    return block
+
+def binary_cube(plan, paths, chunk_size=1000, agent_value=1):
+    # Lazy (year, lat, lon) dask array of the warped presence/absence of an agent, chunked on the
+    # destination grid with all years in each chunk
+    import dask.array as dsa
+
+    for path in paths:
+        with rasterio.open(path) as src:
+            check_source_grid(plan, src)
+
+    dst_height, dst_width = plan['dst_shape']
+    template = dsa.zeros((len(paths), dst_height, dst_width), dtype=np.uint8, chunks=(len(paths), chunk_size, chunk_size))
+
+    def warp_chunk(chunk, block_info=None):
+        (_, _), (row_start, row_stop), (col_start, col_stop) = block_info[None]['array-location']
+        window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+        return warp_block(plan, paths, window, agent_value=agent_value)
+
+    return template.map_blocks(warp_chunk, dtype=np.uint8)
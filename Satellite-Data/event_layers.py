@@ -0,0 +1,70 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Shared processing of the FORWIND and DEFID2 disturbance event polygons. Clipping to the EURO-CORDEX box uses the STRtree spatial index of the GeoDataFrame: polygons fully inside the box are kept untouched and only the few crossing its boundary are intersected. Event layers are written as GeoParquet with per-row bbox columns, sorted by year and Hilbert distance, and with their metadata in the file, so that readers can push down bbox and date filters."
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import box
+
+# Rows per Parquet row group, the unit that bbox and date filters skip
+event_row_group_size = 2000
+
+def clip_to_box(gdf, min_lon, min_lat, max_lon, max_lat):
+    # Polygons of gdf within the box, with the same columns and order as gdf. Polygons crossing the
+    # box boundary are cut to the box, and are dropped if nothing polygonal is left
+    bbox = box(min_lon, min_lat, max_lon, max_lat)
+    candidates = np.sort(gdf.sindex.query(bbox, predicate='intersects'))
+    inside = gdf.sindex.query(bbox, predicate='contains_properly')
+    crossing = np.setdiff1d(candidates, inside)
+
+    clipped = gdf.iloc[candidates].copy()
+    if crossing.size:
+        cut = shapely.intersection(gdf.geometry.values[crossing], bbox)
+        positions = np.searchsorted(candidates, crossing)
+        geometry = clipped.geometry.values.copy()
+        geometry[positions] = cut
+
+        # Intersections touching the box along a line or point come back as collections, keep their polygons
+        collections = np.flatnonzero(shapely.get_type_id(cut) == 7)
+        for i in collections:
+            parts = shapely.get_parts(cut[i])
+            polygons = parts[np.isin(shapely.get_type_id(parts), [3, 6])]
+            geometry[positions[i]] = shapely.union_all(polygons) if polygons.size else shapely.Polygon()
+        clipped = clipped.set_geometry(geometry)
+
+        keep = np.ones(len(clipped), dtype=bool)
+        kept_geometry = geometry[positions]
+        keep[positions] = ~shapely.is_empty(kept_geometry) & np.isin(shapely.get_type_id(kept_geometry), [3, 6])
+        clipped = clipped[keep]
+
+    return clipped
+
+def write_geoparquet(gdf, path, metadata, date_column, row_group_size=event_row_group_size):
+    # Sort by event year, then by Hilbert distance within the year, so that each row group covers a
+    # short period and a compact area and its statistics (bbox columns, dates) let readers skip it.
+    # The metadata is kept in the file (read back as gdf.attrs) instead of a sidecar file
+    hilbert = gdf.hilbert_distance(total_bounds=gdf.total_bounds)
+    order = np.lexsort((hilbert.values, gdf[date_column].dt.year.values))
+    sorted_gdf = gdf.iloc[order].reset_index(drop=True)
+    sorted_gdf.attrs = dict(metadata)
+
+    sorted_gdf.to_parquet(
+        path,
+        index=False,
+        compression='zstd',
+        write_covering_bbox=True,
+        row_group_size=row_group_size,
+    )
+    return path
+
+def read_geoparquet(path, bbox=None, start=None, end=None, date_column=None, columns=None):
+    # Read the events whose bounding box intersects bbox (min_lon, min_lat, max_lon, max_lat), between
+    # start and end (both included), reading only the row groups whose statistics match
+    filters = []
+    if start is not None:
+        filters.append((date_column, '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append((date_column, '<=', pd.Timestamp(end)))
+    return gpd.read_parquet(path, bbox=bbox, filters=filters or None, columns=columns)
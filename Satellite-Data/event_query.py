@@ -0,0 +1,124 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Spatio-temporal queries over the processed FORWIND and DEFID2 event layers: which events hit a cell or region between two dates, and how much of it. Each layer gets an index (STRtree of the geometries, event dates sorted once, equal-area geometries for the intersected areas) that is built once, cached on disk and answers single or batched bbox/polygon + date range queries."
+
+import hashlib
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+
+# Equal area projection used for the areas, as in the processing scripts
+area_crs = 'EPSG:6933'
+
+# Date column of each processed event layer
+event_date_columns = {
+    'FORWIND': 'EventDate_dt',
+    'DEFID2': 'survey_date',
+}
+
+def index_fingerprint(path, date_column):
+    stat = os.stat(path)
+    key = repr((os.path.abspath(path), stat.st_size, stat.st_mtime_ns, date_column, area_crs))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def pack_wkb(geometries):
+    # WKB of every geometry in one byte buffer plus offsets, so it is saved without pickling
+    wkb = shapely.to_wkb(geometries)
+    offsets = np.concatenate([[0], np.cumsum([len(item) for item in wkb])]).astype(np.int64)
+    return np.frombuffer(b''.join(wkb), dtype=np.uint8), offsets
+
+def unpack_wkb(buffer, offsets):
+    data = buffer.tobytes()
+    return shapely.from_wkb([data[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])])
+
+def build_event_index(gdf, date_column):
+    # Events are identified by their row in the layer
+    geometry = gdf.to_crs('EPSG:4326').geometry.to_numpy()
+    # Some event geometries are invalid, they are repaired for the intersections only
+    area_geometry = shapely.make_valid(gdf.to_crs(area_crs).geometry.to_numpy())
+    dates = gdf[date_column].values.astype('datetime64[ns]')
+    order = np.argsort(dates, kind='stable')
+
+    return make_index(geometry, area_geometry, dates, order)
+
+def make_index(geometry, area_geometry, dates, order):
+    return {
+        'tree': shapely.STRtree(geometry),
+        'geometry': geometry,
+        'area_geometry': area_geometry,
+        'dates': dates,
+        'date_order': order,
+        'sorted_dates': dates[order],
+        'to_area_crs': Transformer.from_crs('EPSG:4326', area_crs, always_xy=True),
+    }
+
+def load_or_build_event_index(cache_dir, path, date_column):
+    # The index only depends on the layer file, so build it once and keep it on disk
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = f'{cache_dir}/event_index_{index_fingerprint(path, date_column)}.npz'
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            geometry = unpack_wkb(cached['geometry'], cached['geometry_offsets'])
+            area_geometry = unpack_wkb(cached['area_geometry'], cached['area_geometry_offsets'])
+            return make_index(geometry, area_geometry, cached['dates'], cached['date_order'])
+
+    index = build_event_index(gpd.read_parquet(path), date_column)
+    geometry, geometry_offsets = pack_wkb(index['geometry'])
+    area_geometry, area_geometry_offsets = pack_wkb(index['area_geometry'])
+    np.savez(
+        cache_file,
+        geometry=geometry, geometry_offsets=geometry_offsets,
+        area_geometry=area_geometry, area_geometry_offsets=area_geometry_offsets,
+        dates=index['dates'], date_order=index['date_order'],
+    )
+
+    return index
+
+def events_in_period(index, start=None, end=None):
+    # Boolean mask of the events between start and end (both included), from the sorted dates
+    first = 0 if start is None else np.searchsorted(index['sorted_dates'], np.datetime64(pd.Timestamp(start), 'ns'), side='left')
+    last = len(index['sorted_dates']) if end is None else np.searchsorted(index['sorted_dates'], np.datetime64(pd.Timestamp(end), 'ns'), side='right')
+    in_period = np.zeros(len(index['dates']), dtype=bool)
+    in_period[index['date_order'][first:last]] = True
+    return in_period
+
+def as_geometries(regions):
+    # Query regions as shapely geometries (lon/lat), from geometries or (min_lon, min_lat, max_lon, max_lat) boxes
+    if isinstance(regions, gpd.GeoSeries):
+        return regions.to_crs('EPSG:4326').to_numpy()
+    regions = np.asarray(regions, dtype=object) if not isinstance(regions, np.ndarray) else regions
+    if regions.dtype == object and any(isinstance(region, shapely.Geometry) for region in regions.ravel()):
+        return regions
+    # Boxes, one (4,) tuple or a list/array of them
+    regions = np.atleast_2d(regions.astype(np.float64))
+    return shapely.box(regions[:, 0], regions[:, 1], regions[:, 2], regions[:, 3])
+
+def query_events_batch(index, regions, start=None, end=None):
+    # Events intersecting each of many regions (cells) between start and end. Returns one row per
+    # (query, event) pair with the event date and the intersected area in ha
+    queries = as_geometries(regions)
+    query_ids, event_ids = index['tree'].query(queries, predicate='intersects')
+
+    in_period = events_in_period(index, start, end)[event_ids]
+    query_ids, event_ids = query_ids[in_period], event_ids[in_period]
+
+    area_queries = shapely.transform(queries, lambda xy: np.column_stack(index['to_area_crs'].transform(xy[:, 0], xy[:, 1])))
+    intersected = shapely.intersection(area_queries[query_ids], index['area_geometry'][event_ids])
+
+    return pd.DataFrame({
+        'query_id': query_ids,
+        'event_id': event_ids,
+        'event_date': index['dates'][event_ids],
+        'area_ha': shapely.area(intersected) / 10000,
+    })
+
+def query_events(index, region, start=None, end=None):
+    # Events intersecting one bbox (min_lon, min_lat, max_lon, max_lat) or polygon between start and end
+    if not isinstance(region, shapely.Geometry):
+        region = shapely.box(*region)
+    return query_events_batch(index, np.array([region], dtype=object), start, end).drop(columns='query_id')
@@ -0,0 +1,137 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Rasterisation of the FORWIND and DEFID2 event polygons to (year, lat, lon) affected area fraction cubes on the 1km and 0.1 degree grids of the EURO-CORDEX domain. The polygons of each year are burned on a supersampled grid tile by tile and block-averaged to the target cells; (year, tile) tasks run in a pool of worker processes and tiles without events are written as 0."
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import shapely
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+
+from netcdf_store import create_netcdf
+
+# Fine cells per target cell along each axis (1km: ~90m, 0.1 degree: ~250m)
+event_supersample = {
+    '1km': 10,
+    '0.1deg': 40,
+}
+
+# Largest supersampled tile along each axis, bounds the memory of a task
+max_supersampled_tile = 4000
+
+def tile_size(supersample):
+    return max(1, max_supersampled_tile // supersample)
+
+def grid_tiles(grid, size):
+    # (row, col, n_rows, n_cols) of the tiles of a target grid, in target cells
+    n_lat, n_lon = grid['lat'].size, grid['lon'].size
+    for row in range(0, n_lat, size):
+        for col in range(0, n_lon, size):
+            yield row, col, min(size, n_lat - row), min(size, n_lon - col)
+
+def rasterise_tile(wkb, grid, tile, supersample):
+    # Affected fraction of the cells of one tile: the polygons (their union, overlapping events are
+    # counted once) are burned on the supersampled grid and averaged over each target cell.
+    # Rows are returned in ascending latitude, as the target grid
+    row, col, n_rows, n_cols = tile
+    resolution = grid['resolution']
+    fine = resolution / supersample
+    north = grid['min_lat'] + (row + n_rows) * resolution
+    west = grid['min_lon'] + col * resolution
+
+    burned = rasterize(
+        [(geometry, 1) for geometry in shapely.from_wkb(wkb)],
+        out_shape=(n_rows * supersample, n_cols * supersample),
+        transform=from_origin(west, north, fine, fine),
+        fill=0,
+        dtype=np.uint8,
+    )
+    fraction = burned.reshape(n_rows, supersample, n_cols, supersample).mean(axis=(1, 3), dtype=np.float32)
+
+    return fraction[::-1]
+
+def tile_bounds(grid, tile):
+    row, col, n_rows, n_cols = tile
+    resolution = grid['resolution']
+    return (
+        grid['min_lon'] + col * resolution, grid['min_lat'] + row * resolution,
+        grid['min_lon'] + (col + n_cols) * resolution, grid['min_lat'] + (row + n_rows) * resolution,
+    )
+
+def event_tasks(gdf, years, year_values, grid, size):
+    # (year index, tile, WKB of the year's polygons touching the tile), only for tiles with events
+    for i, year in enumerate(years):
+        year_gdf = gdf[year_values == year]
+        if len(year_gdf) == 0:
+            continue
+        tree = year_gdf.sindex
+        for tile in grid_tiles(grid, size):
+            hits = tree.query(shapely.box(*tile_bounds(grid, tile)), predicate='intersects')
+            if hits.size:
+                yield i, tile, shapely.to_wkb(year_gdf.geometry.values[hits])
+
+def rasterise_events(gdf, date_column, grids, out_paths, attrs=None, max_workers=None, prefetch=2):
+    # One (year, lat, lon) affected fraction file per target grid. 0 is a real value (no event in the
+    # cell), so the fill value is NaN and tiles without events are written as 0 explicitly
+    max_workers = max_workers or os.cpu_count()
+    # Events without a date cannot be placed in a year
+    gdf = gdf[gdf[date_column].notna()].to_crs('EPSG:4326')
+    year_values = gdf[date_column].dt.year.values.astype(np.int32)
+    years = np.unique(year_values)
+
+    # The processing scripts are not wrapped in a __main__ guard, so workers are forked where possible
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+    else:
+        mp_context = None
+
+    for name, grid in grids.items():
+        supersample = event_supersample[name]
+        size = tile_size(supersample)
+        nc = create_netcdf(
+            out_paths[name],
+            {'year': years, 'lat': grid['lat'], 'lon': grid['lon']},
+            {'affected_fraction': {
+                'dims': ('year', 'lat', 'lon'), 'dtype': 'f4',
+                'chunksizes': (1, min(size, grid['lat'].size), min(size, grid['lon'].size)),
+                'fill_value': np.float32(np.nan), 'attrs': {'units': 'fraction of the cell area'},
+            }},
+            attrs=dict(attrs or {}, Filename=out_paths[name].split('/')[-1]),
+        )
+        tasks = event_tasks(gdf, years, year_values, grid, size)
+        rasterised = set()
+
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+                in_flight = {}
+
+                def submit_next():
+                    task = next(tasks, None)
+                    if task is not None:
+                        i, tile, wkb = task
+                        future = executor.submit(rasterise_tile, wkb, grid, tile, supersample)
+                        in_flight[future] = (i, tile)
+
+                for _ in range(max_workers * prefetch):
+                    submit_next()
+
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i, (row, col, n_rows, n_cols) = in_flight.pop(future)
+                        nc['affected_fraction'][i, row:row + n_rows, col:col + n_cols] = future.result()
+                        rasterised.add((i, row, col))
+                        submit_next()
+
+            # Tiles that no event touches
+            for i in range(years.size):
+                for row, col, n_rows, n_cols in grid_tiles(grid, size):
+                    if (i, row, col) not in rasterised:
+                        nc['affected_fraction'][i, row:row + n_rows, col:col + n_cols] = np.zeros((n_rows, n_cols), dtype=np.float32)
+        finally:
+            nc.close()
+
+    return out_paths
@@ -0,0 +1,201 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Local SQLite catalog of the downloaded satellite granules (product, date, group, sensor, version, path, size and validity), shared by the download and process scripts so inputs are selected with indexed queries instead of directory walks."
+
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from glob import glob
+
+from granule_names import filename_parsers
+from zip_access import vsizip_path, is_vsizip_path, split_vsizip_path, list_members
+
+# Default location of the catalog, next to the downloaded data
+default_catalog_path = '/data/atsr/OptForEU/granule_catalog.sqlite'
+
+catalog_schema = '''
+CREATE TABLE IF NOT EXISTS granules (
+    path TEXT PRIMARY KEY,
+    product TEXT NOT NULL,
+    date TEXT NOT NULL,
+    product_group TEXT,
+    sensor TEXT,
+    version TEXT,
+    size INTEGER,
+    mtime REAL,
+    valid INTEGER NOT NULL DEFAULT 1,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS granules_product_date ON granules (product, date);
+CREATE INDEX IF NOT EXISTS granules_product_valid_date ON granules (product, valid, date);
+'''
+
+def open_catalog(catalog_path=default_catalog_path):
+    os.makedirs(os.path.dirname(os.path.abspath(catalog_path)), exist_ok=True)
+    conn = sqlite3.connect(catalog_path)
+    conn.executescript(catalog_schema)
+    return conn
+
+def format_date(date):
+    # Dates are stored as ISO strings so that range queries can use the index
+    if isinstance(date, str):
+        return datetime.strptime(date[:10], '%Y-%m-%d').strftime('%Y-%m-%d')
+    return date.strftime('%Y-%m-%d')
+
+def granule_key(path):
+    # Path as stored in the catalog: absolute for plain files, and for /vsizip/ members the absolute
+    # archive path as register_archive_members writes it (os.path.abspath would collapse the '//')
+    if is_vsizip_path(path):
+        return vsizip_path(*split_vsizip_path(path))
+    return os.path.abspath(path)
+
+def register_granules(conn, paths, product, check=None, max_workers=16):
+    # Add (or refresh) files in the catalog. Files already registered with the same size and
+    # modification time are skipped, so registering the same directory again is cheap
+    parse_filename = filename_parsers[product]
+    known = {
+        path: (size, mtime)
+        for path, size, mtime in conn.execute('SELECT path, size, mtime FROM granules WHERE product = ?', (product,))
+    }
+
+    new_granules = []
+    for path in paths:
+        path = granule_key(path)
+        parsed = parse_filename(path)
+        if parsed is None:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if known.get(path) == (stat.st_size, stat.st_mtime):
+            continue
+        new_granules.append((path, parsed, stat))
+
+    # Validate only the new or changed files
+    if check is not None:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            checks = list(executor.map(check, [path for path, parsed, stat in new_granules]))
+    else:
+        checks = [(path, True, '') for path, parsed, stat in new_granules]
+
+    rows = []
+    for (path, parsed, stat), (_, valid, reason) in zip(new_granules, checks):
+        rows.append((
+            path, product, format_date(parsed['date']), parsed['group'], parsed['sensor'],
+            parsed['version'], stat.st_size, stat.st_mtime, int(valid), reason
+        ))
+
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO granules VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    return len(rows)
+
+def register_archive_members(conn, zip_path, product, suffixes=None, check=None):
+    # Add the members of a zip archive as /vsizip/ paths, so they can be read without extracting
+    # them. The archive is checked once and its validity applies to all of its members
+    parse_filename = filename_parsers[product]
+    zip_path = os.path.abspath(zip_path)
+    valid, reason = True, ''
+    if check is not None:
+        _, valid, reason = check(zip_path)
+    if not valid:
+        members = []
+    else:
+        members = list_members(zip_path, suffixes=suffixes)
+    mtime = os.stat(zip_path).st_mtime
+
+    rows = []
+    for info in members:
+        parsed = parse_filename(info.filename)
+        if parsed is None:
+            continue
+        rows.append((
+            vsizip_path(zip_path, info.filename), product, format_date(parsed['date']), parsed['group'],
+            parsed['sensor'], parsed['version'], info.file_size, mtime, 1, ''
+        ))
+    if not valid:
+        # Keep a record of the broken archive itself so it shows up in query_invalid
+        rows.append((zip_path, product, format_date(datetime.fromtimestamp(mtime)), None, None, None,
+                     os.path.getsize(zip_path), mtime, 0, reason))
+
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO granules VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    return len(rows)
+
+def scan_directory(conn, pattern, product, check=None, recursive=False):
+    # The one directory walk, done once after a download instead of in every process script
+    return register_granules(conn, glob(pattern, recursive=recursive), product, check=check)
+
+def query_granules(conn, product, start=None, end=None, group=None, sensor=None, valid_only=True):
+    # Paths of the granules of a product between start and end (inclusive), sorted by date
+    sql = 'SELECT path FROM granules WHERE product = ?'
+    params = [product]
+    if valid_only:
+        sql += ' AND valid = 1'
+    if start is not None:
+        sql += ' AND date >= ?'
+        params.append(format_date(start))
+    if end is not None:
+        sql += ' AND date <= ?'
+        params.append(format_date(end))
+    if group is not None:
+        sql += ' AND product_group = ?'
+        params.append(group)
+    if sensor is not None:
+        sql += ' AND sensor = ?'
+        params.append(sensor)
+    sql += ' ORDER BY date, path'
+
+    return [path for (path,) in conn.execute(sql, params)]
+
+def query_invalid(conn, product):
+    return list(conn.execute(
+        'SELECT path, reason FROM granules WHERE product = ? AND valid = 0 ORDER BY date', (product,)
+    ))
+
+def find_missing_dates(conn, product, expected_dates, group=None, sensor=None, valid_only=True):
+    # Gap detection against the dates recorded in the catalog, optionally for one group (e.g. LAI RT0)
+    # or sensor only, so a granule of another group on the same date does not hide a gap
+    sql = 'SELECT DISTINCT date FROM granules WHERE product = ?'
+    params = [product]
+    if valid_only:
+        sql += ' AND valid = 1'
+    if group is not None:
+        sql += ' AND product_group = ?'
+        params.append(group)
+    if sensor is not None:
+        sql += ' AND sensor = ?'
+        params.append(sensor)
+    catalogued = {date for (date,) in conn.execute(sql, params)}
+
+    return [date for date in expected_dates if format_date(date) not in catalogued]
+
+def remove_granules(conn, paths):
+    with conn:
+        conn.executemany('DELETE FROM granules WHERE path = ?', [(granule_key(path),) for path in paths])
+
+# Files or zip archives of a catalogued product (LAI, FIRES, SMAP_SOC or TCD, the products with a
+# filename parser in granule_names.py) downloaded by hand can be added with, e.g.:
+#   python granule_catalog.py FIRES '/data/atsr/OptForEU/C3S_Burned_Area/*.zip'
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f'Usage: python {sys.argv[0]} PRODUCT PATTERN [CATALOG]')
+        sys.exit(1)
+
+    product, pattern = sys.argv[1], sys.argv[2]
+    catalog_path = sys.argv[3] if len(sys.argv) > 3 else default_catalog_path
+
+    from granule_checks import check_file
+
+    conn = open_catalog(catalog_path)
+    paths = glob(pattern, recursive=True)
+    # Zip archives are catalogued by their members
+    n_added = register_granules(conn, [path for path in paths if not path.endswith('.zip')], product, check=check_file)
+    for zip_path in [path for path in paths if path.endswith('.zip')]:
+        n_added += register_archive_members(conn, zip_path, product, check=check_file)
+    conn.close()
+    print(f'Registered {n_added} {product} files in {catalog_path}')
@@ -0,0 +1,163 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Fast integrity checks for downloaded NetCDF/HDF5 granules and a filename-based inventory of missing 10-daily (dekad) dates. Only file signatures, sizes and headers are read, never the data variables."
+
+import calendar
+import os
+import struct
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import h5py
+from netCDF4 import Dataset
+
+from granule_names import parse_lai_filename
+
+# Magic numbers at the start of each file format
+hdf5_signature = b'\x89HDF\r\n\x1a\n'
+netcdf_classic_signatures = (b'CDF\x01', b'CDF\x02', b'CDF\x05')
+# The HDF5 superblock may sit after a user block of 0, 512, 1024, 2048... bytes
+hdf5_superblock_offsets = (0, 512, 1024, 2048, 4096, 8192)
+
+# netCDF4-python is not thread-safe, h5py already serialises its own calls
+netcdf_lock = threading.Lock()
+
+def find_hdf5_superblock(fh, file_size):
+    for offset in hdf5_superblock_offsets:
+        if offset + len(hdf5_signature) > file_size:
+            break
+        fh.seek(offset)
+        if fh.read(len(hdf5_signature)) == hdf5_signature:
+            return offset
+    return None
+
+def hdf5_end_of_file(fh, offset):
+    # Read the end-of-file address stored in the superblock, which tells us how big the file should be
+    fh.seek(offset + len(hdf5_signature))
+    version = fh.read(1)[0]
+    if version in (0, 1):
+        # version, free-space, root group, reserved, shared header, size of offsets, size of lengths,
+        # reserved, leaf node K, internal node K, consistency flags (and indexed storage K for version 1)
+        head = fh.read(15 if version == 0 else 19)
+        size_of_offsets = head[4]
+        addresses = fh.read(3 * size_of_offsets)
+        base_address = int.from_bytes(addresses[:size_of_offsets], 'little')
+        eof_address = int.from_bytes(addresses[2 * size_of_offsets:], 'little')
+    else:
+        # size of offsets, size of lengths, flags, then base, extension and end-of-file addresses
+        head = fh.read(3)
+        size_of_offsets = head[0]
+        addresses = fh.read(3 * size_of_offsets)
+        base_address = int.from_bytes(addresses[:size_of_offsets], 'little')
+        eof_address = int.from_bytes(addresses[2 * size_of_offsets:], 'little')
+
+    return base_address + eof_address
+
+def check_granule(path, min_size=1024, read_header=True):
+    # Returns (path, valid, reason), where reason is empty for a valid file
+    try:
+        file_size = os.path.getsize(path)
+    except OSError:
+        return path, False, 'missing'
+
+    if file_size < min_size:
+        return path, False, f'too small ({file_size} bytes)'
+
+    try:
+        with open(path, 'rb') as fh:
+            signature = fh.read(len(hdf5_signature))
+            if signature[:4] in netcdf_classic_signatures:
+                file_format = 'netcdf_classic'
+            else:
+                offset = find_hdf5_superblock(fh, file_size)
+                if offset is None:
+                    return path, False, 'not a NetCDF/HDF5 file'
+                file_format = 'hdf5'
+                # A truncated download is shorter than the size recorded in its superblock
+                expected_size = hdf5_end_of_file(fh, offset)
+                if expected_size > file_size:
+                    return path, False, f'truncated ({file_size} of {expected_size} bytes)'
+    except (OSError, IndexError, struct.error):
+        return path, False, 'unreadable signature'
+
+    if read_header:
+        # Opening the file only reads its metadata, no data variables are loaded
+        try:
+            if file_format == 'hdf5':
+                with h5py.File(path, 'r') as h5_file:
+                    h5_file.visit(lambda name: None)
+            else:
+                with netcdf_lock:
+                    with Dataset(path, 'r') as nc_file:
+                        nc_file.variables.keys()
+        except (OSError, RuntimeError, KeyError, ValueError) as err:
+            return path, False, f'unreadable header ({err})'
+
+    return path, True, ''
+
+def check_archive(path, min_size=1024):
+    # Zip downloads are only checked through their central directory, the members are not decompressed
+    try:
+        file_size = os.path.getsize(path)
+    except OSError:
+        return path, False, 'missing'
+
+    if file_size < min_size:
+        return path, False, f'too small ({file_size} bytes)'
+
+    try:
+        with zipfile.ZipFile(path) as zip_file:
+            if len(zip_file.infolist()) == 0:
+                return path, False, 'empty archive'
+    except (OSError, zipfile.BadZipFile) as err:
+        return path, False, f'unreadable archive ({err})'
+
+    return path, True, ''
+
+def check_file(path):
+    # Pick the check from the file extension, other formats (e.g. GeoTIFF) are only checked for size
+    if path.endswith('.zip'):
+        return check_archive(path)
+    if path.endswith(('.nc', '.h5', '.hdf5')):
+        return check_granule(path)
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        return path, True, ''
+    return path, False, 'missing or empty'
+
+def validate_granules(paths, max_workers=16, min_size=1024, read_header=True):
+    # The checks are dominated by file system latency, so run them in a thread pool
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(
+            lambda path: check_granule(path, min_size=min_size, read_header=read_header),
+            paths
+        ))
+    return results
+
+def expected_dekads(start, end):
+    # LAI is produced for the 10th, 20th and last day of each month
+    start = datetime.strptime(start, '%Y-%m-%d') if isinstance(start, str) else start
+    end = datetime.strptime(end, '%Y-%m-%d') if isinstance(end, str) else end
+
+    dekads = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        last_day = calendar.monthrange(year, month)[1]
+        for day in (10, 20, last_day):
+            date = datetime(year, month, day)
+            if start <= date <= end:
+                dekads.append(date)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return dekads
+
+def missing_dekads(paths, start, end, parse_filename=parse_lai_filename):
+    # Dates come from the filenames, so no file is opened here
+    downloaded_dates = set()
+    for path in paths:
+        parsed = parse_filename(path)
+        if parsed is not None:
+            downloaded_dates.add(parsed['date'])
+
+    return [date for date in expected_dekads(start, end) if date not in downloaded_dates]
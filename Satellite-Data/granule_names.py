@@ -0,0 +1,96 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Filename parsers for the downloaded satellite granules, so that dates and product versions are read from the name of each file instead of fixed string offsets."
+
+import os
+import re
+from datetime import datetime
+
+# Copernicus Global Land Service LAI filenames, e.g.
+#   c_gls_LAI300_201401100000_GLOBE_PROBAV_V1.0.1.nc      (RT5, no productGroupId in the filename)
+#   c_gls_LAI300-RT0_201609100000_GLOBE_PROBAV_V1.0.1.nc
+#   c_gls_LAI300-RT0_202007100000_GLOBE_OLCI_V1.1.2.nc
+lai_pattern = re.compile(
+    r'c_gls_LAI300(?:-(?P<group>RT\d))?_(?P<date>\d{8})(?P<hhmm>\d{4})_GLOBE_(?P<sensor>[A-Z0-9\-]+)_V(?P<version>\d+(?:\.\d+)*)'
+)
+
+def parse_lai_filename(path):
+    # Returns None for anything that is not an LAI granule, so callers can filter a directory listing
+    match = lai_pattern.search(os.path.basename(path))
+    if match is None:
+        return None
+
+    return {
+        'product': 'LAI',
+        'date': datetime.strptime(match.group('date'), '%Y%m%d'),
+        # The consolidated RT5 product does not include its productGroupId in the filename
+        'group': match.group('group') or 'RT5',
+        'sensor': match.group('sensor'),
+        'version': match.group('version'),
+    }
+
+# C3S pixel burned area monthly files inside the yearly zip downloads, e.g.
+#   20170101-C3S-L3S_FIRE-BA-OLCI-AREA_3-fv1.1.nc
+fires_pattern = re.compile(
+    r'(?P<date>\d{8})-C3S-L3S_FIRE-BA-(?P<sensor>[A-Z]+)-AREA_(?P<area>\d+)-fv(?P<version>\d+(?:\.\d+)*)'
+)
+
+def parse_fires_filename(path):
+    match = fires_pattern.search(os.path.basename(path))
+    if match is None:
+        return None
+
+    return {
+        'product': 'FIRES',
+        'date': datetime.strptime(match.group('date'), '%Y%m%d'),
+        'group': f"AREA_{match.group('area')}",
+        'sensor': match.group('sensor'),
+        'version': match.group('version'),
+    }
+
+# SMAP L4 carbon daily files, e.g.
+#   SMAP_L4_C_mdl_20150401T000000_Vv7041_001.h5
+smap_pattern = re.compile(
+    r'SMAP_L4_C_mdl_(?P<date>\d{8})T(?P<hhmmss>\d{6})_V(?P<version>[A-Za-z0-9]+)_(?P<counter>\d{3})\.h5$'
+)
+
+def parse_smap_filename(path):
+    match = smap_pattern.search(os.path.basename(path))
+    if match is None:
+        return None
+
+    return {
+        'product': 'SMAP_SOC',
+        'date': datetime.strptime(match.group('date'), '%Y%m%d'),
+        'group': 'L4_C_mdl',
+        'sensor': 'SMAP',
+        'version': match.group('version'),
+    }
+
+# Tree Cover Density High-Resolution Layer mosaics, e.g.
+#   TCD_2012_100m_eu_03035_d04_full.tif
+#   TCD_2018_100m_eu_03035_V2_0.tif
+tcd_pattern = re.compile(
+    r'TCD_(?P<year>\d{4})_(?P<resolution>\d+m)_eu_(?P<epsg>\d+)_(?P<version>.+?)(?:_full)?\.tif$'
+)
+
+def parse_tcd_filename(path):
+    match = tcd_pattern.search(os.path.basename(path))
+    if match is None:
+        return None
+
+    return {
+        'product': 'TCD',
+        'date': datetime(int(match.group('year')), 1, 1),
+        'group': match.group('resolution'),
+        'sensor': 'HRL',
+        'version': match.group('version'),
+    }
+
+# Parser for each product, so scripts can pick one by name
+filename_parsers = {
+    'LAI': parse_lai_filename,
+    'FIRES': parse_fires_filename,
+    'SMAP_SOC': parse_smap_filename,
+    'TCD': parse_tcd_filename,
+}
@@ -0,0 +1,54 @@
+__author__ = "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
+__version__ = "1"
+__description__ = "Creates the NetCDF4 (year, lat, lon) output files up front, with their coordinates, chunking, compression and attributes, so that the processing scripts can write them region by region (a year, or a block of cells) instead of holding the whole product in memory. Multi-resolution products are stored as one group per level of a single file."
+
+import numpy as np
+from netCDF4 import Dataset
+
+def define_variables(nc, coords, variables):
+    # Dimensions, coordinates and variables of a Dataset or of one of its groups
+    for dim, values in coords.items():
+        values = np.asarray(values)
+        if values.dtype.kind == 'O':
+            values = values.astype(str)
+        nc.createDimension(dim, values.size)
+        if values.dtype.kind in 'US':
+            coord = nc.createVariable(dim, str, (dim,))
+            for i, value in enumerate(values):
+                coord[i] = str(value)
+        else:
+            coord = nc.createVariable(dim, values.dtype, (dim,))
+            coord[:] = values
+
+    for name, spec in variables.items():
+        variable = nc.createVariable(
+            name,
+            spec['dtype'],
+            spec['dims'],
+            zlib=spec.get('zlib', True),
+            complevel=spec.get('complevel', 4),
+            chunksizes=spec.get('chunksizes'),
+            fill_value=spec.get('fill_value'),
+        )
+        variable.setncatts(spec.get('attrs', {}))
+
+def create_netcdf(path, coords, variables, attrs=None):
+    # coords: {dimension name: 1-D values}, in the order of the dimensions
+    # variables: {name: {'dims': (...), 'dtype': ..., 'chunksizes': (...), 'fill_value': ..., 'attrs': {...}}}
+    # Returns the open Dataset, variables are written with slices, e.g. nc[name][i, :, :] = ...
+    nc = Dataset(path, 'w', format='NETCDF4')
+    define_variables(nc, coords, variables)
+    nc.setncatts(attrs or {})
+
+    return nc
+
+def create_multiscale_netcdf(path, groups, attrs=None):
+    # One group per resolution level, groups: {level name: (coords, variables)} as for create_netcdf.
+    # The level names are listed, finest first, in the 'multiscales' attribute. Returns the open
+    # Dataset, variables are written with slices, e.g. nc[level][name][i, :, :] = ...
+    nc = Dataset(path, 'w', format='NETCDF4')
+    for level, (coords, variables) in groups.items():
+        define_variables(nc.createGroup(level), coords, variables)
+    nc.setncatts(dict(attrs or {}, multiscales=' '.join(groups)))
+
+    return nc
@@ -0,0 +1,161 @@
+__author__ = "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
+__version__ = "1"
+__description__ = "Batched extraction of the time series of many points (e.g. forest inventory plots) from the gridded EFMI and projection outputs. The grid cell of every point is found once, by index arithmetic on regular lat/lon grids or with a KD-tree of the cell centres on curvilinear grids such as the SMAP EASE-Grid, and the points are grouped by on-disk chunk so each chunk is read once for all its points. Values are returned as a tidy table, one row per point and time step."
+
+import numpy as np
+import pandas as pd
+
+# Bytes read from a file at once, the time axis is split into whole disk chunks to stay within it
+read_budget = 256 * 1024**2
+
+# Tolerance on the spacing of a regular coordinate: a few units in the last place of its largest value
+# (float32 coordinates are rounded value by value) or a small fraction of the step (coordinates written
+# with a fixed number of decimals), whichever is larger
+regular_tolerance_ulps = 4
+regular_tolerance = 1e-3
+
+def regular_indices(coord, values):
+    # Index of the cell of each value along a regular 1-D coordinate (ascending or descending), -1
+    # outside the grid
+    coord = np.asarray(coord)
+    eps = np.finfo(coord.dtype if coord.dtype.kind == 'f' else np.float64).eps
+    coord = coord.astype(np.float64)
+    step = (coord[-1] - coord[0]) / (coord.size - 1)
+    tolerance = max(regular_tolerance_ulps * eps * np.abs(coord).max(), regular_tolerance * abs(step))
+    if not np.allclose(np.diff(coord), step, rtol=0, atol=tolerance):
+        raise ValueError('Coordinate is not regular, use curvilinear_indices')
+    indices = np.rint((np.asarray(values, dtype=np.float64) - coord[0]) / step).astype(np.int64)
+    indices[(indices < 0) | (indices >= coord.size)] = -1
+    return indices
+
+def unit_vectors(lat, lon):
+    # Points on the unit sphere, so KD-tree distances are chord lengths whatever the longitude
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+def curvilinear_indices(lat2d, lon2d, lat, lon):
+    # (row, col) of the nearest cell centre of each point on a 2-D grid, -1 where the nearest centre is
+    # farther than the spacing of the grid (outside the grid)
+    from scipy.spatial import cKDTree
+
+    centres = unit_vectors(np.asarray(lat2d, dtype=np.float64), np.asarray(lon2d, dtype=np.float64))
+    tree = cKDTree(centres.reshape(-1, 3))
+    distance, flat = tree.query(unit_vectors(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)))
+
+    spacing = max(
+        np.nanmedian(np.linalg.norm(np.diff(centres, axis=0), axis=-1)),
+        np.nanmedian(np.linalg.norm(np.diff(centres, axis=1), axis=-1)),
+    )
+    rows, cols = np.unravel_index(flat, lat2d.shape)
+    outside = ~(distance <= spacing)
+    rows[outside] = -1
+    cols[outside] = -1
+    return rows, cols
+
+def wrap_longitudes(lon, grid_lon):
+    # Points in the longitude convention of the grid, -180..180 or 0..360
+    lon = np.asarray(lon, dtype=np.float64)
+    if np.nanmax(grid_lon) > 180:
+        return lon % 360
+    return (lon + 180) % 360 - 180
+
+def point_indices(grid_lat, grid_lon, lat, lon):
+    # (row, col) of the cell of each point on a regular (1-D coordinates) or curvilinear (2-D) grid
+    grid_lat, grid_lon = np.asarray(grid_lat), np.asarray(grid_lon)
+    lon = wrap_longitudes(lon, grid_lon)
+    if grid_lat.ndim == 1:
+        rows, cols = regular_indices(grid_lat, lat), regular_indices(grid_lon, lon)
+        outside = (rows < 0) | (cols < 0)
+        rows[outside] = -1
+        cols[outside] = -1
+        return rows, cols
+    return curvilinear_indices(grid_lat, grid_lon, lat, lon)
+
+def chunk_groups(rows, cols, chunks):
+    # Positions of the points in each on-disk (row, col) chunk, points outside the grid are left out
+    inside = np.flatnonzero(rows >= 0)
+    if inside.size == 0:
+        return []
+    keys = (rows[inside] // chunks[0]) * (cols.max() // chunks[1] + 1) + cols[inside] // chunks[1]
+    order = np.argsort(keys, kind='stable')
+    split = np.flatnonzero(np.diff(keys[order])) + 1
+    return np.split(inside[order], split)
+
+def leading_blocks(shape, chunks, window_size, itemsize):
+    # Slices of the leading (non spatial) dimensions read at once. All are read whole except the last
+    # one (usually time), split into whole disk chunks so a read stays within the budget
+    if not shape:
+        return [()]
+    other = int(np.prod(shape[:-1]))
+    step = read_budget // max(1, other * window_size * itemsize)
+    step = max(chunks[-1], step // chunks[-1] * chunks[-1])
+    whole = tuple(slice(None) for _ in shape[:-1])
+    return [whole + (slice(start, min(start + step, shape[-1])),) for start in range(0, shape[-1], step)]
+
+def extract_array(array, rows, cols, chunks, fill_value=None):
+    # Values (..., point) of a (..., row, col) array-like (h5py Dataset, netCDF4 Variable or xarray
+    # DataArray opened without dask) at the cells of the points, reading each disk chunk with points
+    # only once. chunks is the on-disk chunking of the array. Points outside the grid are NaN
+    shape = tuple(array.shape)
+    values = np.full(shape[:-2] + (rows.size,), np.nan, dtype=np.float32)
+
+    for group in chunk_groups(rows, cols, chunks[-2:]):
+        r0, r1 = rows[group].min(), rows[group].max() + 1
+        c0, c1 = cols[group].min(), cols[group].max() + 1
+        for block in leading_blocks(shape[:-2], chunks[:-2], (r1 - r0) * (c1 - c0), np.dtype(array.dtype).itemsize):
+            data = np.asarray(array[block + (slice(r0, r1), slice(c0, c1))], dtype=np.float32)
+            if fill_value is not None:
+                data[data == fill_value] = np.nan
+            values[block + (group,)] = data[..., rows[group] - r0, cols[group] - c0]
+
+    return values
+
+def tidy_table(values, name, leading_coords, point_ids):
+    # One row per point and combination of the leading coordinates (model, scenario, time...), with
+    # the value in the column name
+    index = pd.MultiIndex.from_product([point_ids] + list(leading_coords.values()), names=['point'] + list(leading_coords))
+    data = np.moveaxis(values, -1, 0).reshape(-1)
+    return pd.DataFrame({name: data}, index=index).reset_index()
+
+def extract_points(path, variables, lat, lon, point_ids=None, lat_name=None, lon_name=None):
+    # Tidy table of each variable of a netCDF file at the points, {variable: DataFrame}. The variables
+    # share the grid of the file, so the cells of the points are found once. Variables must have their
+    # (lat, lon) dimensions last, as all the outputs of the repository
+    import xarray as xr
+
+    variables = [variables] if isinstance(variables, str) else list(variables)
+    point_ids = np.arange(np.size(lat)) if point_ids is None else np.asarray(point_ids)
+
+    tables = {}
+    with xr.open_dataset(path) as ds:
+        lat_name = lat_name or ('latitude' if 'latitude' in ds.variables else 'lat')
+        lon_name = lon_name or ('longitude' if 'longitude' in ds.variables else 'lon')
+        rows, cols = point_indices(ds[lat_name].values, ds[lon_name].values, lat, lon)
+
+        spatial = ds[lat_name].dims if ds[lat_name].ndim == 2 else ds[lat_name].dims + ds[lon_name].dims
+
+        for name in variables:
+            da = ds[name]
+            if da.dims[-2:] != spatial:
+                raise ValueError(f'The last dimensions of {name} are not {spatial}')
+            chunks = da.encoding.get('chunksizes') or da.shape
+            leading_coords = {dim: ds[dim].values if dim in ds.coords else np.arange(da.sizes[dim]) for dim in da.dims[:-2]}
+
+            # Without dask every slice of the DataArray only reads (and decodes) its hyperslab
+            values = extract_array(da, rows, cols, chunks)
+            tables[name] = tidy_table(values, name, leading_coords, point_ids)
+
+    return tables
+
+def extract_h5_points(h5_path, variable, lat, lon, point_ids=None, geo_group='GEO', fill_value=None):
+    # Tidy table of a variable of an HDF5 file on a curvilinear grid (e.g. SMAP L4 on the EASE-Grid
+    # 2.0, with the cell centres in GEO/latitude and GEO/longitude) at the points
+    import h5py
+
+    point_ids = np.arange(np.size(lat)) if point_ids is None else np.asarray(point_ids)
+    with h5py.File(h5_path, 'r') as h5_file:
+        rows, cols = point_indices(h5_file[geo_group]['latitude'][:], h5_file[geo_group]['longitude'][:], lat, lon)
+        dataset = h5_file[variable]
+        values = extract_array(dataset, rows, cols, dataset.chunks or dataset.shape, fill_value=fill_value)
+
+    return tidy_table(values, variable.split('/')[-1], {}, point_ids)
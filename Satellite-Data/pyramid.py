@@ -0,0 +1,128 @@
+__author__ = "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
+__version__ = "1"
+__description__ = "Multi-resolution pyramids of the gridded EFMI products. The coarser levels (5km, 10km and the 0.1 degree ERA5-Land resolution) are reduced in cascade from the finest (1km) output, each level from the coarsest previous level whose cells it is made of, and all the levels are written in one pass as the groups of a single netCDF file. Means are carried through the cascade as sums and counts of the valid cells, so every level is the exact mean of the finest cells it covers."
+
+import threading
+
+import numpy as np
+
+from block_reduce import block_reduce, block_coord, valid_mask, is_integer_factor
+from netcdf_store import create_multiscale_netcdf
+
+# Spatial chunk of the finest level, a multiple of the integer factors of the cascade
+pyramid_chunk = 1000
+# Spatial chunk of the variables in the file
+pyramid_file_chunk = 500
+
+# Statistics carried from level to level, and how each is reduced. Means are sums and counts of the
+# valid cells until the level is written
+cascade_statistics = {
+    'mean': {'sum': 'sum', 'count': 'sum'},
+    'sum': {'sum': 'sum'},
+    'min': {'min': 'min'},
+    'max': {'max': 'max'},
+    'any': {'any': 'any'},
+}
+
+def pyramid_levels(resolution):
+    # Factor of each level from the finest (1km) resolution in degrees, finest first
+    return {'1km': 1, '5km': 5, '10km': 10, '0.1deg': 0.1 / resolution}
+
+def cascade_factors(levels):
+    # (parent level, factor) of each coarser level, in increasing order of factor. The parent is the
+    # coarsest previous level whose cells the level is made of (integer ratio), otherwise the finest
+    # level, e.g. 1km -> 5km -> 10km and 1km -> 0.1deg (11.25 with 1/112.5 degree cells)
+    names = sorted(levels, key=levels.get)
+    cascade = {}
+    for i, name in enumerate(names[1:], start=1):
+        parent = names[0]
+        for previous in names[1:i]:
+            ratio = levels[name] / levels[previous]
+            if is_integer_factor(ratio):
+                parent = previous
+        cascade[name] = (parent, levels[name] / levels[parent])
+    return cascade
+
+def finest_level(data, how):
+    if how == 'mean':
+        return {'sum': data, 'count': valid_mask(data).astype(np.float32)}
+    return {how: data}
+
+def reduce_level(level, factor, how):
+    # Next level of the cascade from the carried statistics of the previous one
+    return {
+        name: block_reduce(level[name], factor, (statistic,))[statistic]
+        for name, statistic in cascade_statistics[how].items()
+    }
+
+def level_values(level, how):
+    if how == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(level['count'] > 0, level['sum'] / level['count'], np.nan).astype(level['sum'].dtype)
+    return level[how]
+
+def build_pyramid(data, levels, how='mean'):
+    # Lazy arrays of every level from a (..., lat, lon) dask array at the finest level
+    import dask.array as dsa
+
+    if how not in cascade_statistics:
+        raise ValueError(f'Unknown statistic: {how}')
+
+    factors = cascade_factors(levels)
+    finest = min(levels, key=levels.get)
+    data = dsa.asarray(data).rechunk((1,) * (data.ndim - 2) + (pyramid_chunk, pyramid_chunk))
+
+    carried = {finest: finest_level(data, how)}
+    arrays = {finest: level_values(carried[finest], how)}
+    for name, (parent, factor) in factors.items():
+        carried[name] = reduce_level(carried[parent], factor, how)
+        arrays[name] = level_values(carried[name], how)
+
+    return arrays
+
+def level_coords(coord, levels):
+    # Coordinate of each level, reduced in cascade as the data
+    coords = {min(levels, key=levels.get): coord}
+    for name, (parent, factor) in cascade_factors(levels).items():
+        coords[name] = block_coord(coords[parent], factor)
+    return coords
+
+def write_pyramid(path, da, levels=None, how='mean', attrs=None, lat_name='lat', lon_name='lon'):
+    # Write the levels of a (..., lat, lon) DataArray as the groups of one netCDF file, every level is
+    # computed from the same pass over the finest data
+    import dask.array as dsa
+
+    dims = [dim for dim in da.dims if dim not in (lat_name, lon_name)] + [lat_name, lon_name]
+    da = da.transpose(*dims)
+    lat, lon = da[lat_name].values, da[lon_name].values
+    levels = levels or pyramid_levels(abs(float(lat[-1] - lat[0])) / (lat.size - 1))
+
+    arrays = build_pyramid(da.data, levels, how=how)
+    lats, lons = level_coords(lat, levels), level_coords(lon, levels)
+    leading = {dim: da[dim].values if dim in da.coords else np.arange(da.sizes[dim]) for dim in dims[:-2]}
+    name = da.name
+
+    groups = {}
+    for level, array in arrays.items():
+        groups[level] = (
+            dict(leading, **{lat_name: lats[level], lon_name: lons[level]}),
+            {name: {
+                'dims': tuple(dims),
+                'dtype': 'u1' if array.dtype == bool else array.dtype,
+                'chunksizes': (1,) * len(leading) + (min(pyramid_file_chunk, lats[level].size), min(pyramid_file_chunk, lons[level].size)),
+                'attrs': dict(da.attrs, factor=levels[level]),
+            }},
+        )
+
+    nc = create_multiscale_netcdf(path, groups, attrs=attrs)
+    try:
+        # netCDF4-python is not thread-safe, so writes are serialised
+        dsa.store(
+            [array.astype(np.uint8) if array.dtype == bool else array for array in arrays.values()],
+            [nc[level][name] for level in arrays],
+            lock=threading.Lock(),
+        )
+    finally:
+        nc.close()
+
+    return path
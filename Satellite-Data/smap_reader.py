@@ -0,0 +1,122 @@
+__author__ = "Dr. Rocio Barrio Guillo, Dr. Jasdeep S. Anand"
+__version__ = "1"
+__description__ = "Streaming daily to monthly reduction of the SMAP L4 soil carbon HDF5 files. Only the EURO-CORDEX window of each file is read (h5py hyperslab) and added to per-month sum/count accumulators, so memory is one European map per month instead of every global day."
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from itertools import groupby
+
+import h5py
+import numpy as np
+
+# Fill value of the SMAP L4 carbon variables
+smap_fill_value = -9999
+
+def europe_window(h5_path, min_lon, max_lon, min_lat, max_lat, geo_group='GEO'):
+    # Rows and columns of the EASE-Grid 2.0 cells within the bounding box. The grid is cylindrical,
+    # so latitude only changes along rows and longitude along columns and the window is a rectangle
+    with h5py.File(h5_path, 'r') as h5_file:
+        lat_data = h5_file[geo_group]['latitude'][:]
+        lon_data = h5_file[geo_group]['longitude'][:]
+
+    in_box = (
+            (lat_data >= min_lat) & (lat_data <= max_lat) &
+            (lon_data >= min_lon) & (lon_data <= max_lon)
+            )
+    rows = np.where(in_box.any(axis=1))[0]
+    cols = np.where(in_box.any(axis=0))[0]
+    window = (slice(int(rows[0]), int(rows[-1]) + 1), slice(int(cols[0]), int(cols[-1]) + 1))
+
+    return window, lat_data[window], lon_data[window]
+
+def read_window(h5_path, window, variable='SOC/soc_mean'):
+    # Hyperslab read, only the window is read from disk
+    with h5py.File(h5_path, 'r') as h5_file:
+        return h5_file[variable][window]
+
+def month_start(date):
+    return datetime(date.year, date.month, 1)
+
+def accumulate(monthly_sums, monthly_counts, month, data, fill_value=smap_fill_value):
+    # Add one day to the running sum and count of its month, leaving out the fill values
+    valid = (data != fill_value) & np.isfinite(data)
+    merge_partial(monthly_sums, monthly_counts, month, np.where(valid, data, 0), valid)
+
+def merge_partial(monthly_sums, monthly_counts, month, sums, counts):
+    # Add a partial sum and count (one day, or several days reduced by a worker) to its month
+    if month not in monthly_sums:
+        monthly_sums[month] = np.zeros(sums.shape, dtype=np.float64)
+        monthly_counts[month] = np.zeros(sums.shape, dtype=np.int32)
+    monthly_sums[month] += sums
+    monthly_counts[month] += counts
+
+def monthly_means(monthly_sums, monthly_counts):
+    # Stack the months in time order, cells without any valid day are NaN
+    months = sorted(monthly_sums)
+    means = np.full((len(months),) + monthly_sums[months[0]].shape, np.nan, dtype=np.float32)
+    for i, month in enumerate(months):
+        counts = monthly_counts[month]
+        np.divide(monthly_sums[month], counts, out=means[i], where=counts > 0, casting='unsafe')
+
+    return months, means
+
+def reduce_files(h5_paths, month, window, variable='SOC/soc_mean', fill_value=smap_fill_value):
+    # Worker task: partial sum and count of a batch of daily files from the same month
+    monthly_sums = {}
+    monthly_counts = {}
+    for h5_path in h5_paths:
+        data = read_window(h5_path, window, variable=variable)
+        accumulate(monthly_sums, monthly_counts, month, data, fill_value=fill_value)
+
+    return monthly_sums[month], monthly_counts[month]
+
+def month_batches(h5_paths, dates, files_per_task):
+    # Group the (date sorted) files by month and split each month into batches for the workers
+    batches = []
+    files = sorted(zip(dates, h5_paths))
+    for month, month_files in groupby(files, key=lambda item: month_start(item[0])):
+        month_paths = [h5_path for date, h5_path in month_files]
+        for i in range(0, len(month_paths), files_per_task):
+            batches.append((month, month_paths[i:i + files_per_task]))
+
+    return batches
+
+def reduce_monthly_parallel(h5_paths, dates, window, variable='SOC/soc_mean', fill_value=smap_fill_value,
+                            max_workers=None, files_per_task=8, prefetch=2):
+    # Read and reduce the daily files in a pool of worker processes (h5py serialises reads within one
+    # process, so threads would not help). At most max_workers * prefetch batches are in flight, which
+    # bounds memory, and the partial sums are merged into their month as they come back
+    max_workers = max_workers or os.cpu_count()
+    batches = iter(month_batches(h5_paths, dates, files_per_task))
+    # The processing scripts are not wrapped in a __main__ guard, so workers are forked where possible
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+    else:
+        mp_context = None
+
+    monthly_sums = {}
+    monthly_counts = {}
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+        in_flight = {}
+
+        def submit_next():
+            batch = next(batches, None)
+            if batch is not None:
+                month, batch_paths = batch
+                future = executor.submit(reduce_files, batch_paths, month, window, variable, fill_value)
+                in_flight[future] = month
+
+        for _ in range(max_workers * prefetch):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                month = in_flight.pop(future)
+                sums, counts = future.result()
+                merge_partial(monthly_sums, monthly_counts, month, sums, counts)
+                submit_next()
+
+    return monthly_means(monthly_sums, monthly_counts)
@@ -0,0 +1,111 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Persistent cache of the EURO-CORDEX subsets of global gridded granules (LAI, AGB, LST, FIRES). The bbox subset of each granule is copied once to a compressed, chunked netCDF file keyed by the source path, size and modification time, the bbox and the variables. The values and attributes are kept as stored in the source (not decoded), so the processing scripts open the cached file exactly as they opened the source. Entries are evicted least recently used first when the cache grows over its size budget."
+
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from zip_access import is_vsizip_path, split_vsizip_path, open_netcdf
+
+# Size budget of a cache directory, the least recently used entries are removed above it
+cache_budget = 500 * 1024**3
+
+# Chunks of the cached files (along lat and lon) and of the copy from the source
+cache_chunk = 500
+copy_chunk = 4000
+
+def source_stat(path):
+    # Zip members change when their archive does
+    if is_vsizip_path(path):
+        path = split_vsizip_path(path)[0]
+    return os.stat(path)
+
+def subset_key(path, bounds, variables):
+    stat = source_stat(path)
+    key = repr((path if is_vsizip_path(path) else os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+                tuple(float(value) for value in bounds), tuple(variables or ())))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def coord_window(coord, min_value, max_value):
+    # Contiguous index range of a monotonic coordinate within [min_value, max_value]
+    inside = np.flatnonzero((coord >= min_value) & (coord <= max_value))
+    return slice(int(inside[0]), int(inside[-1]) + 1)
+
+def write_subset(path, cache_file, bounds, variables, lat_name='lat', lon_name='lon'):
+    # Copy the bbox (min_lon, max_lon, min_lat, max_lat) of the source, chunk by chunk, to a temporary
+    # file that is renamed in place once complete, so readers never see a partial entry
+    min_lon, max_lon, min_lat, max_lat = bounds
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+
+    with open_netcdf(path, decode_cf=False) as ds:
+        if variables is not None:
+            ds = ds[list(variables)]
+        window = {
+            lat_name: coord_window(ds[lat_name].values, min_lat, max_lat),
+            lon_name: coord_window(ds[lon_name].values, min_lon, max_lon),
+        }
+        subset = ds.isel(window).chunk({lat_name: copy_chunk, lon_name: copy_chunk})
+
+        encoding = {}
+        for name, var in subset.variables.items():
+            var.encoding = {}
+            if lat_name in var.dims and lon_name in var.dims:
+                encoding[name] = {
+                    'zlib': True,
+                    'complevel': 4,
+                    'chunksizes': tuple(
+                        min(cache_chunk, size) if dim in window else 1 for dim, size in zip(var.dims, var.shape)
+                    ),
+                }
+        try:
+            subset.to_netcdf(tmp_file, engine='netcdf4', encoding=encoding)
+            os.replace(tmp_file, cache_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+def evict(cache_dir, budget=cache_budget, keep=()):
+    # Remove the least recently used entries (oldest modification time, refreshed on every hit) until
+    # the cache fits its budget
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.startswith('subset_') and entry.name.endswith('.nc'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= budget:
+            break
+        if entry_path in keep:
+            continue
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def cached_subset(path, bounds, cache_dir, variables=None, budget=cache_budget, lat_name='lat', lon_name='lon'):
+    # Path of the cached bbox (min_lon, max_lon, min_lat, max_lat) subset of a granule (a plain or
+    # /vsizip/ path), creating it on the first use
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = f'{cache_dir}/subset_{subset_key(path, bounds, variables)}.nc'
+
+    if os.path.exists(cache_file):
+        now = time.time()
+        os.utime(cache_file, (now, now))
+        return cache_file
+
+    write_subset(path, cache_file, bounds, variables, lat_name=lat_name, lon_name=lon_name)
+    evict(cache_dir, budget=budget, keep=(cache_file,))
+
+    return cache_file
+
+def cached_subsets(paths, bounds, cache_dir, variables=None, budget=cache_budget, lat_name='lat', lon_name='lon'):
+    return [
+        cached_subset(path, bounds, cache_dir, variables=variables, budget=budget, lat_name=lat_name, lon_name=lon_name)
+        for path in paths
+    ]
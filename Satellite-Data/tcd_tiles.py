@@ -0,0 +1,183 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Tiled reading and resampling of the 100m Tree Cover Density mosaics. The mosaic is read in windows aligned to its internal GeoTIFF blocks and to the resampling factor, the 254/255 flags are masked in uint8 space and each window is block-reduced into a pre-allocated 1km output, so peak memory is a few tiles instead of the whole raster. The change between years is computed in a single tile-parallel pass over the co-located windows of all years."
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import ExitStack
+from math import lcm
+
+import numpy as np
+import rasterio
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds, transform as window_transform
+
+from cog_writer import tiled_profile, to_cog
+from block_reduce import reduce_blocks
+
+# Values of the TCD layer that are not tree cover density (254 unclassifiable, 255 outside area)
+tcd_nodata_values = (254, 255)
+
+def output_window(src, bounding_box, factor):
+    # Window of the coarse grid (src.transform scaled by factor) within the lat/lon bounding box
+    out_transform = src.transform * src.transform.scale(factor, factor)
+    out_height, out_width = src.height // factor, src.width // factor
+
+    bbox_projected = transform_bounds("EPSG:4326", src.crs, *bounding_box)
+    window = from_bounds(*bbox_projected, transform=out_transform).round_offsets().round_lengths()
+    window = window.intersection(Window(0, 0, out_width, out_height))
+
+    return window, window_transform(window, out_transform)
+
+def tile_windows(src, out_window, factor, tile_size=4096):
+    # Source windows covering out_window, aligned to the internal blocks of the GeoTIFF and to the
+    # factor, so that every block is decoded once and every coarse cell falls in a single tile
+    block_height, block_width = src.block_shapes[0]
+    tile_height = lcm(block_height, factor)
+    tile_width = lcm(block_width, factor)
+    tile_height *= max(1, tile_size // tile_height)
+    tile_width *= max(1, tile_size // tile_width)
+
+    row_start, row_stop = out_window.row_off * factor, (out_window.row_off + out_window.height) * factor
+    col_start, col_stop = out_window.col_off * factor, (out_window.col_off + out_window.width) * factor
+
+    for row in range((row_start // tile_height) * tile_height, row_stop, tile_height):
+        for col in range((col_start // tile_width) * tile_width, col_stop, tile_width):
+            row_off, col_off = max(row, row_start), max(col, col_start)
+            height = min(row + tile_height, row_stop) - row_off
+            width = min(col + tile_width, col_stop) - col_off
+            yield Window(col_off, row_off, width, height)
+
+def reduce_tile(data, factor, method='nearest', nodata_values=tcd_nodata_values):
+    # Reduce a uint8 tile by factor in each direction. 'nearest' keeps the pixel at the centre of each
+    # block (the pixel GDAL nearest resampling picks), so values stay within the original 0-100%.
+    # 'mean' is the mean of the valid pixels of each block
+    n_rows, n_cols = data.shape[0] // factor, data.shape[1] // factor
+    blocks = data[:n_rows * factor, :n_cols * factor].reshape(n_rows, factor, n_cols, factor)
+    reduced = np.full((n_rows, n_cols), np.nan, dtype=np.float32)
+
+    if method == 'nearest':
+        centre = blocks[:, factor // 2, :, factor // 2]
+        valid = ~np.isin(centre, nodata_values)
+        reduced[valid] = centre[valid]
+    elif method == 'mean':
+        reduced = reduce_blocks(blocks, None, ('mean',), nodata_values=nodata_values, dtype=np.float32)['mean']
+    else:
+        raise ValueError(f'Unknown method: {method}')
+
+    return reduced
+
+def read_reduce_tiles(path, bounding_box, factor, method='nearest', tile_size=4096):
+    # Read the mosaic tile by tile into a pre-allocated output on the coarse grid, clipped to the bounding box
+    with rasterio.open(path) as src:
+        out_window, out_transform = output_window(src, bounding_box, factor)
+        reduced = np.full((int(out_window.height), int(out_window.width)), np.nan, dtype=np.float32)
+
+        for window in tile_windows(src, out_window, factor, tile_size=tile_size):
+            data = src.read(1, window=window)
+            out_row = window.row_off // factor - out_window.row_off
+            out_col = window.col_off // factor - out_window.col_off
+            tile_reduced = reduce_tile(data, factor, method=method)
+            reduced[out_row:out_row + tile_reduced.shape[0], out_col:out_col + tile_reduced.shape[1]] = tile_reduced
+
+        profile = src.profile
+        profile.update({
+            "height": reduced.shape[0],
+            "width": reduced.shape[1],
+            "transform": out_transform,
+            "dtype": 'float32',
+            "nodata": np.nan,
+        })
+
+    return reduced, profile
+
+def grid_offset(src_base, src):
+    # (row, col) offset of a mosaic relative to the base mosaic. The years are differenced pixel by
+    # pixel, so the mosaics must share the CRS, pixel size and pixel alignment
+    if src.crs != src_base.crs or src.res != src_base.res:
+        raise ValueError(f'{src.name} is not on the same grid as {src_base.name}')
+    col, row = ~src.transform * (src_base.transform.c, src_base.transform.f)
+    if abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6:
+        raise ValueError(f'{src.name} is not aligned with {src_base.name}')
+    return int(round(row)), int(round(col))
+
+def read_reduce_window(path, window, offset, factor, method='nearest'):
+    # Read a window given in the pixels of the base mosaic, pixels outside this mosaic are outside area (255)
+    with rasterio.open(path) as src:
+        shifted = Window(window.col_off + offset[1], window.row_off + offset[0], window.width, window.height)
+        inside = (shifted.col_off >= 0 and shifted.row_off >= 0
+                  and shifted.col_off + shifted.width <= src.width and shifted.row_off + shifted.height <= src.height)
+        data = src.read(1, window=shifted, boundless=not inside, fill_value=255)
+    return reduce_tile(data, factor, method=method)
+
+def change_tile(paths, offsets, window, factor, method='nearest'):
+    # Co-located window of every year at 1km, differenced with the first (base) year
+    reduced = [read_reduce_window(path, window, offset, factor, method) for path, offset in zip(paths, offsets)]
+    return [year_reduced - reduced[0] for year_reduced in reduced[1:]]
+
+def change_tiles(paths, out_paths, bounding_box, factor, tags=None, method='nearest', max_workers=None,
+                 tile_size=4096, prefetch=2, compress='DEFLATE'):
+    # Change of each later year (paths[1:]) with respect to the base year (paths[0]) in a single pass
+    # over the tiles, spread over a pool of worker processes. Each tile is written to the outputs as
+    # soon as it comes back, and at most max_workers * prefetch tiles are in flight, so memory stays flat.
+    # The outputs are written to temporary tiled GeoTIFFs and converted to COGs at the end
+    max_workers = max_workers or os.cpu_count()
+    tags = tags or [{}] * len(out_paths)
+
+    with ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(path)) for path in paths]
+        out_window, out_transform = output_window(sources[0], bounding_box, factor)
+        offsets = [grid_offset(sources[0], src) for src in sources]
+        windows = iter(list(tile_windows(sources[0], out_window, factor, tile_size=tile_size)))
+        crs = sources[0].crs
+
+    profile = tiled_profile({
+        "height": int(out_window.height),
+        "width": int(out_window.width),
+        "count": 1,
+        "dtype": 'float32',
+        "crs": crs,
+        "transform": out_transform,
+        "nodata": np.nan,
+    })
+    tmp_paths = [f'{out_path}.tmp.tif' for out_path in out_paths]
+
+    # The processing scripts are not wrapped in a __main__ guard, so workers are forked where possible
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+    else:
+        mp_context = None
+
+    with ExitStack() as stack:
+        destinations = [stack.enter_context(rasterio.open(tmp_path, 'w', **profile)) for tmp_path in tmp_paths]
+        executor = stack.enter_context(ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context))
+        in_flight = {}
+
+        def submit_next():
+            window = next(windows, None)
+            if window is not None:
+                future = executor.submit(change_tile, paths, offsets, window, factor, method)
+                in_flight[future] = window
+
+        for _ in range(max_workers * prefetch):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                window = in_flight.pop(future)
+                changes = future.result()
+                out_row = window.row_off // factor - out_window.row_off
+                out_col = window.col_off // factor - out_window.col_off
+                for dst, change in zip(destinations, changes):
+                    dst.write(change, 1, window=Window(out_col, out_row, change.shape[1], change.shape[0]))
+                submit_next()
+
+        for dst, dst_tags in zip(destinations, tags):
+            dst.update_tags(1, **dst_tags)
+
+    for tmp_path, out_path in zip(tmp_paths, out_paths):
+        to_cog(tmp_path, out_path, compress=compress, remove_src=True)
+
+    return out_paths
@@ -0,0 +1,31 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from event_query import build_event_index, query_events, query_events_batch
+
+def event_index():
+    # Two 1x1 degree events, one in each of two neighbouring 10x10 degree boxes
+    gdf = gpd.GeoDataFrame(
+        {'date': pd.to_datetime(['2010-06-01', '2012-06-01'])},
+        geometry=[shapely.box(4, 44, 5, 45), shapely.box(14, 44, 15, 45)],
+        crs='EPSG:4326',
+    )
+    return build_event_index(gdf, 'date')
+
+def test_query_events_batch_box_tuples():
+    index = event_index()
+    events = query_events_batch(index, [(0, 40, 10, 50), (10, 40, 20, 50)])
+
+    assert events['query_id'].tolist() == [0, 1]
+    assert events['event_id'].tolist() == [0, 1]
+    assert np.all(events['area_ha'] > 0)
+
+def test_query_events_batch_geometries_and_single_box():
+    index = event_index()
+    by_geometry = query_events_batch(index, [shapely.box(0, 40, 10, 50)])
+    by_box = query_events(index, (0, 40, 10, 50))
+
+    assert by_geometry['event_id'].tolist() == by_box['event_id'].tolist() == [0]
+    assert np.isclose(by_geometry['area_ha'].iloc[0], by_box['area_ha'].iloc[0])
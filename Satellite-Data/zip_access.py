@@ -0,0 +1,54 @@
+__author__ = "Dr. Jasdeep S. Anand, Dr. Rocio Barrio Guillo"
+__version__ = "1"
+__description__ = "Read NetCDF and GeoTIFF members straight out of the downloaded zip archives, without extracting them to disk. Members are addressed with GDAL /vsizip/ paths, which rasterio opens directly."
+
+import io
+import os
+import zipfile
+from contextlib import contextmanager
+
+vsizip_prefix = '/vsizip/'
+
+def vsizip_path(zip_path, member):
+    return f'{vsizip_prefix}{os.path.abspath(zip_path)}/{member}'
+
+def is_vsizip_path(path):
+    return path.startswith(vsizip_prefix)
+
+def split_vsizip_path(path):
+    # '/vsizip//data/file.zip/dir/member.nc' -> ('/data/file.zip', 'dir/member.nc')
+    inner = path[len(vsizip_prefix):]
+    split_at = inner.lower().index('.zip/') + len('.zip')
+    return inner[:split_at], inner[split_at + 1:]
+
+def list_members(zip_path, suffixes=None):
+    # Only the central directory of the archive is read
+    with zipfile.ZipFile(zip_path) as zip_file:
+        members = [info for info in zip_file.infolist() if not info.is_dir()]
+    if suffixes is not None:
+        members = [info for info in members if info.filename.lower().endswith(tuple(suffixes))]
+    return sorted(members, key=lambda info: info.filename)
+
+@contextmanager
+def open_netcdf(path, **kwargs):
+    # Open a NetCDF4/HDF5 file with xarray, whether it is a plain path or a /vsizip/ member. Stored
+    # (uncompressed) members are read in place, compressed members are decompressed into memory
+    # one at a time, never to disk
+    import xarray as xr
+
+    if not is_vsizip_path(path):
+        with xr.open_dataset(path, **kwargs) as ds:
+            yield ds
+        return
+
+    zip_path, member = split_vsizip_path(path)
+    with zipfile.ZipFile(zip_path) as zip_file:
+        if zip_file.getinfo(member).compress_type == zipfile.ZIP_STORED:
+            file_obj = zip_file.open(member)
+        else:
+            file_obj = io.BytesIO(zip_file.read(member))
+        try:
+            with xr.open_dataset(file_obj, engine='h5netcdf', **kwargs) as ds:
+                yield ds
+        finally:
+            file_obj.close()